@@ -2,8 +2,8 @@ import time
 from typing import Dict, Tuple
 import pandas as pd
 
+from ..Problems.catalog import RecipeCatalog, load_catalog
 from ..Problems.state import State
-from ..Problems.utils import Piece
 
 
 def _load_piece_dataset(piece_dataset_path) -> pd.DataFrame:
@@ -13,35 +13,36 @@ def _load_piece_dataset(piece_dataset_path) -> pd.DataFrame:
         raise FileNotFoundError(f"Product dataset not found at {piece_dataset_path}")
 
 
-def _load_action_dataset(action_dataset_path) -> pd.DataFrame:
-    try:
-        return pd.read_csv(action_dataset_path)
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Product dataset not found at {action_dataset_path}")
+def _load_action_dataset(action_dataset_path, available_products=None) -> RecipeCatalog:
+    return load_catalog(action_dataset_path, available_products=available_products)
 
 
 class Experiment:
     def __init__(self, problem, solvers, start_date, piece_dataset, action_dataset, number_of_days=1,
-                 meals_per_day=3, parameters=None):
+                 meals_per_day=3, parameters=None, time_limit=None):
+        if isinstance(piece_dataset, str):
+            piece_dataset = _load_piece_dataset(piece_dataset)
+        if isinstance(action_dataset, str):
+            action_dataset = _load_action_dataset(action_dataset, piece_dataset["Product Name"])
+        elif isinstance(action_dataset, pd.DataFrame):
+            # Parse the recipes once instead of once per solver
+            action_dataset = RecipeCatalog.from_dataframe(action_dataset)
         self.solvers = solvers
         self.piece_dataset = piece_dataset
         self.action_dataset = action_dataset
         self.current_state = None
-        self.pieces_with_dates = self.piece_dataset[["Product Name", "Date"]]
+        self.pieces_with_dates = self.piece_dataset[["Product Name", "Date", "Quantity"]]
         self.start_date = start_date
         self.number_of_days = number_of_days
         self.meals_per_day = meals_per_day
         self.parameters = parameters
         self.problem = problem
+        # Seconds every solver gets before it has to return its best plan so far, None for no limit
+        self.time_limit = time_limit
 
     @staticmethod
     def create_initial_state(piece_dataset) -> State:
-        available_pieces = []
-        for index, row in piece_dataset.iterrows():
-            piece = Piece(row["Product Name"], row["Quantity"], row["Date"])
-            available_pieces.append(piece)
-        current_state = State(available_pieces)
-        return current_state
+        return State.from_dataframe(piece_dataset)
 
     def run(self) -> Dict[str, Tuple[State, float]]:
         results = {}
@@ -52,6 +53,9 @@ class Experiment:
                                    parameters_to_maximize=self.parameters)
             self.current_state = self.create_initial_state(self.piece_dataset)
             start_time = time.time()
+            # Every run sets the deadline again, so one left by an earlier run never carries over
+            solver.configure(None if self.time_limit is None else start_time + self.time_limit,
+                             solver.on_improvement, solver.cancellation)
             solver_final_state = solver.solve(problem, self.current_state)
             end_time = time.time()
             solver_time = end_time - start_time
@@ -6,7 +6,8 @@ import pandas as pd
 from datetime import date
 from tkinter import filedialog, messagebox
 from MealOptimizer.Experiments import Experiment
-from MealOptimizer.Problems import MinimizeWasteProblem, ParametersProblem
+from MealOptimizer.Problems import MinimizeWasteProblem, ParametersProblem, load_catalog
+from MealOptimizer.Problems.catalog import CACHE_DIR
 from MealOptimizer import Problems
 from MealOptimizer.Solvers import GreedySolver, SimulatedAnnealingSolver, RLSolver
 import traceback
@@ -115,7 +116,8 @@ class MealPlannerGUI(ctk.CTk):
         if self.settings_frame.sa_var.get():
             selected_solvers.append(SimulatedAnnealingSolver())
         if self.settings_frame.rl_var.get():
-            selected_solvers.append(RLSolver())
+            # The Q-table learned for the same household is reused by later runs
+            selected_solvers.append(RLSolver(cache_dir=CACHE_DIR))
 
         if not selected_solvers:
             messagebox.showerror("Error", "Please select at least one algorithm")
@@ -149,7 +151,7 @@ class MealPlannerGUI(ctk.CTk):
             products_pd =  pd.DataFrame(self.upload_frame.product_list.products,
                          columns=["ID", "Product Name", "Quantity", "Date"])
             recipes_path = self.settings_frame.recipes_path_var.get()
-            recipes_df = pd.read_csv(recipes_path)
+            recipes_catalog = load_catalog(recipes_path, available_products=products_pd["Product Name"])
 
 
             # Create Experiment instance
@@ -158,7 +160,7 @@ class MealPlannerGUI(ctk.CTk):
                 selected_solvers,
                 start_date,
                 products_pd,  # piece_dataset
-                recipes_df,  # action_dataset
+                recipes_catalog,  # action_dataset
                 number_of_days=number_of_days,
                 meals_per_day=meals_per_day,
                 parameters=parameters_to_maximize
@@ -1,2 +1,4 @@
 from .problem import Problem
 from .problem_types import MinimizeWasteProblem, ParametersProblem, CountExpiredItemsProblem
+from .catalog import RecipeCatalog, load_catalog
+from .batch_environment import BatchEnvironment
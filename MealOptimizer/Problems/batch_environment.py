@@ -0,0 +1,83 @@
+import numpy as np
+
+from ..Problems.problem import Problem
+from ..Problems.state import State
+
+
+class BatchEnvironment:
+    """A batch of independent plans of a problem stepped together, one meal slot at a time, on arrays instead of
+    State objects: the quantities are a plans x products matrix and the feasible actions a plans x actions mask.
+    It works for problems whose score is the sum of their action weights plus the plan length times
+    expiring_score of the number of expiring products, which all the problem types are."""
+
+    def __init__(self, problem: Problem, initial_state: State, size: int):
+        if problem.action_weights is None:
+            raise ValueError(f"{type(problem).__name__} does not split its score into action weights.")
+        self.problem = problem
+        self.initial_state = initial_state
+        self.size = size
+        self.reset()
+
+    def reset(self) -> None:
+        """Start every plan of the batch again from the initial state"""
+        problem, state = self.problem, self.initial_state
+        self.quantities = np.tile(problem.state_quantities(state), (self.size, 1))
+        self.lengths = np.full(self.size, len(state.selected_actions), dtype=np.int64)
+        # Actions added to every plan, -1 after the plan ended
+        self.plans = np.full((self.size, max(problem.number_of_days * problem.meals_per_day -
+                                             len(state.selected_actions), 0)), -1, dtype=np.int64)
+        self.steps = 0
+        self.done = np.full(self.size, problem.is_goal_state(state))
+        self.weight_sums = np.full(self.size, problem.selected_weight(state))
+        self.scores = self._scores()
+
+    @property
+    def day(self) -> int:
+        """Day of the next meal of the plans that have not ended, which all have the same length"""
+        return (len(self.initial_state.selected_actions) + self.steps) // self.problem.meals_per_day
+
+    def feasible(self) -> np.ndarray:
+        """Which actions every plan can make next, like Problem.get_available_actions, nothing for ended plans"""
+        problem = self.problem
+        usable = (self.quantities >= 1) & (problem.product_expiration_days > self.day)
+        feasible = (problem.incidence @ usable.T.astype(np.float64)).T == problem.action_sizes
+        feasible[self.done] = False
+        return feasible
+
+    def step(self, actions: np.ndarray) -> np.ndarray:
+        """Make the given action in every plan, -1 ends a plan. Returns the change of the score of every plan."""
+        problem = self.problem
+        active = (actions >= 0) & ~self.done
+        chosen = actions[active]
+        # Every piece of an action takes one of its product while there is one, see State.update_state
+        self.quantities[active] = np.maximum(self.quantities[active] - problem.incidence[chosen].toarray(), 0)
+        self.weight_sums[active] += problem.action_weights[chosen]
+        self.lengths[active] += 1
+        self.plans[active, self.steps] = chosen
+        self.steps += 1
+        self.done |= ~active | (self.lengths >= problem.number_of_days * problem.meals_per_day) | \
+            (len(self.initial_state.pantry) == 0)
+        scores = self._scores()
+        rewards = scores - self.scores
+        self.scores = scores
+        return rewards
+
+    def _scores(self) -> np.ndarray:
+        """Score of every plan, like Problem.get_score"""
+        problem = self.problem
+        tomorrow_days = 1 + self.lengths // problem.meals_per_day
+        expiring = np.count_nonzero((self.quantities > 0) &
+                                    (problem.pantry_expiration_days[None, :] < tomorrow_days[:, None]), axis=1)
+        return self.weight_sums + self.lengths * problem.expiring_score(expiring)
+
+    def plan(self, index: int) -> list:
+        """Indices of the actions added to a plan"""
+        plan = self.plans[index]
+        return plan[plan >= 0].tolist()
+
+    def state(self, index: int) -> State:
+        """The initial state with the actions of a plan made"""
+        state = self.initial_state.__copy__()
+        for action_index in self.plan(index):
+            state.update_state(self.problem.legal_actions[action_index])
+        return state
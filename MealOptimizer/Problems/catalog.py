@@ -0,0 +1,267 @@
+import ast
+import hashlib
+import json
+import os
+import tempfile
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .utils import LegalActionsReport
+
+CACHE_DIR = os.environ.get("MEAL_OPTIMIZER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "meal_optimizer"))
+CATALOG_VERSION = 1
+TEXT_COLUMNS = {"Recipe Name", "Recipe ID", "Products"}
+# Free text columns no problem uses, they are skipped while reading
+UNUSED_COLUMNS = {"Steps", "Description", "nutrition"}
+CHUNK_SIZE = 20000
+
+
+def _parse_products(products):
+    """Parse a 'Products' cell into a list of stripped product names, or None if it is malformed"""
+    try:
+        products = ast.literal_eval(products)
+    except Exception:
+        return None
+    if not isinstance(products, (list, tuple)) or not all(isinstance(product, str) for product in products):
+        return None
+    return [product.strip() for product in products]
+
+
+def file_digest(path, cache_dir=CACHE_DIR) -> str:
+    """Content hash of a file. Hashes are remembered by size and modification time, so an unchanged file is only
+    read once, and a changed file always gets a new digest."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    memo_path = os.path.join(cache_dir, "digests.json")
+    try:
+        with open(memo_path) as memo_file:
+            memo = json.load(memo_file)
+    except (OSError, ValueError):
+        memo = {}
+    size, mtime, digest = memo.get(path, (None, None, None))
+    if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    memo[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_write(memo_path, lambda target: target.write(json.dumps(memo).encode()))
+    return digest
+
+
+def read_recipes(recipes_path, columns: Iterable[str] = None, chunksize=CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Read a recipes CSV in chunks, keeping only the given columns (by default every column but UNUSED_COLUMNS)"""
+    usecols = list(columns) if columns is not None else (lambda column: column not in UNUSED_COLUMNS)
+    try:
+        yield from pd.read_csv(recipes_path, usecols=usecols, chunksize=chunksize)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Recipes dataset not found at {recipes_path}")
+
+
+def _value_range(values: np.ndarray) -> Tuple[float, float]:
+    """Smallest and largest value that is not NaN, both NaN if there is none"""
+    values = values[~np.isnan(values)]
+    return (float(values.min()), float(values.max())) if len(values) else (np.nan, np.nan)
+
+
+def _atomic_write(path, write):
+    directory = os.path.dirname(path)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as target:
+            write(target)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class RecipeCatalog:
+    """A recipes table compiled into flat arrays.
+    Products are interned into a vocabulary and stored CSR style: the products of recipe i are
+    vocabulary[indices[indptr[i]:indptr[i + 1]]]. Numeric recipe columns are kept in `attributes`.
+    A catalog restricted to some products remembers the recipes it dropped, and the ranges of the attributes of the
+    whole catalog it came from."""
+
+    def __init__(self, recipe_ids: np.ndarray, recipe_names: np.ndarray, vocabulary: np.ndarray,
+                 indptr: np.ndarray, indices: np.ndarray, parsed: np.ndarray, attributes: Dict[str, np.ndarray],
+                 digest: str = None, attribute_ranges: Optional[Dict[str, Tuple[float, float]]] = None,
+                 dropped: Optional[Dict[str, int]] = None, missing_products: Optional[Counter] = None):
+        self.recipe_ids = recipe_ids
+        self.recipe_names = recipe_names
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self.parsed = parsed
+        self.attributes = attributes
+        self._digest = digest
+        self._attribute_ranges = attribute_ranges
+        # Recipes dropped by restrict_to, by reason, and the first missing product of each, see LegalActionsReport
+        self.dropped = dropped or {}
+        self.missing_products = missing_products or Counter()
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    @property
+    def columns(self) -> List[str]:
+        return ["Recipe ID", "Recipe Name", "Products"] + list(self.attributes)
+
+    @property
+    def digest(self) -> str:
+        """Content hash of the source file, or of the compiled arrays for catalogs built in memory"""
+        if self._digest is None:
+            sha = hashlib.sha256()
+            for array in (self.recipe_ids, self.vocabulary, self.indptr, self.indices):
+                sha.update(np.ascontiguousarray(array).tobytes())
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    @property
+    def attribute_ranges(self) -> Dict[str, Tuple[float, float]]:
+        """Smallest and largest value of every attribute, over the whole catalog before any restriction"""
+        if self._attribute_ranges is None:
+            self._attribute_ranges = {column: _value_range(values) for column, values in self.attributes.items()}
+        return self._attribute_ranges
+
+    def products(self, index) -> List[str]:
+        return self.vocabulary[self.indices[self.indptr[index]:self.indptr[index + 1]]].tolist()
+
+    @classmethod
+    def from_dataframe(cls, recipes: pd.DataFrame, digest: str = None) -> "RecipeCatalog":
+        products = recipes["Products"].map(_parse_products)
+        parsed = products.notna().to_numpy()
+        lengths = products.map(lambda names: len(names) if names is not None else 0).to_numpy()
+        names = products[parsed].explode().dropna()
+        vocabulary_ids, vocabulary = pd.factorize(names)
+
+        indptr = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        recipe_ids = recipes["Recipe ID"].to_numpy()
+        if recipe_ids.dtype == object:
+            recipe_ids = recipe_ids.astype(str)
+        attributes = {column: recipes[column].to_numpy(dtype=np.float64)
+                      for column in recipes.select_dtypes("number").columns if column not in TEXT_COLUMNS}
+        return cls(recipe_ids, recipes["Recipe Name"].astype(str).to_numpy(dtype=str),
+                   np.asarray(vocabulary, dtype=str), indptr, vocabulary_ids.astype(np.int32), parsed, attributes,
+                   digest)
+
+    @classmethod
+    def from_csv(cls, path, digest: str = None, available_products: Iterable[str] = None,
+                 chunksize=CHUNK_SIZE) -> "RecipeCatalog":
+        """Compile a recipes CSV chunk by chunk. If available_products is given, recipes that use any other product
+        are dropped as each chunk is read, so memory is bounded by one chunk plus the recipes that are kept."""
+        if available_products is not None:
+            available_products = set(available_products)
+        chunks = []
+        for recipes in read_recipes(path, chunksize=chunksize):
+            chunk = cls.from_dataframe(recipes)
+            chunks.append(chunk.restrict_to(available_products) if available_products is not None else chunk)
+        return cls.concatenate(chunks, digest)
+
+    @classmethod
+    def concatenate(cls, catalogs: List["RecipeCatalog"], digest: str = None) -> "RecipeCatalog":
+        """Join catalogs compiled from consecutive parts of the same recipes table"""
+        vocabulary_ids, vocabulary = pd.factorize(np.concatenate([catalog.vocabulary for catalog in catalogs]))
+        offsets = np.cumsum([0] + [len(catalog.vocabulary) for catalog in catalogs])
+        indices = [vocabulary_ids[offset:][catalog.indices] for offset, catalog in zip(offsets, catalogs)]
+        indptr = [np.zeros(1, dtype=np.int64)]
+        for catalog in catalogs:
+            indptr.append(catalog.indptr[1:] + indptr[-1][-1])
+        columns = set.intersection(*(set(catalog.attributes) for catalog in catalogs))
+        attributes = {column: np.concatenate([catalog.attributes[column] for catalog in catalogs])
+                      for column in catalogs[0].attributes if column in columns}
+        attribute_ranges = {column: _value_range(np.array([catalog.attribute_ranges[column] for catalog in catalogs]))
+                            for column in attributes}
+        dropped, missing_products = Counter(), Counter()
+        for catalog in catalogs:
+            dropped.update(catalog.dropped)
+            missing_products.update(catalog.missing_products)
+        return cls(np.concatenate([catalog.recipe_ids for catalog in catalogs]),
+                   np.concatenate([catalog.recipe_names for catalog in catalogs]),
+                   np.asarray(vocabulary, dtype=str), np.concatenate(indptr),
+                   np.concatenate(indices).astype(np.int32),
+                   np.concatenate([catalog.parsed for catalog in catalogs]), attributes, digest, attribute_ranges,
+                   dict(dropped), missing_products)
+
+    def subset(self, recipes: np.ndarray) -> "RecipeCatalog":
+        """The catalog of the recipes at the given positions, it keeps the digest, attribute ranges and dropped
+        recipes of the catalog it came from"""
+        lengths = np.diff(self.indptr)[recipes]
+        indptr = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(self.indptr[recipes] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        products = self.indices[positions]
+        used, indices = np.unique(products, return_inverse=True)
+        return RecipeCatalog(self.recipe_ids[recipes], self.recipe_names[recipes], self.vocabulary[used], indptr,
+                             indices.astype(np.int32), self.parsed[recipes],
+                             {column: values[recipes] for column, values in self.attributes.items()}, self._digest,
+                             self.attribute_ranges, dict(self.dropped), Counter(self.missing_products))
+
+    def restrict_to(self, available_products: Iterable[str]) -> "RecipeCatalog":
+        """The catalog of the recipes whose products are all in available_products. The recipes it drops are counted
+        in `dropped` and `missing_products` like Problem reports them."""
+        usable = np.isin(self.vocabulary, np.asarray(list(available_products), dtype=str))
+        recipe_of_product = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        unusable = np.flatnonzero(~usable[self.indices])
+        # Like Problem, a recipe is dropped for the first product that is missing
+        unusable_recipes, first = np.unique(recipe_of_product[unusable], return_index=True)
+        kept = self.parsed.copy()
+        kept[unusable_recipes] = False
+        catalog = self.subset(np.flatnonzero(kept))
+        missing = self.parsed[unusable_recipes]
+        for reason, count in ((LegalActionsReport.PARSE_ERROR, int((~self.parsed).sum())),
+                              (LegalActionsReport.MISSING_PRODUCT, int(missing.sum()))):
+            catalog.dropped[reason] = catalog.dropped.get(reason, 0) + count
+        catalog.missing_products.update(self.vocabulary[self.indices[unusable[first][missing]]].tolist())
+        return catalog
+
+    def save(self, path):
+        arrays = {"version": np.array(CATALOG_VERSION), "digest": np.array(self.digest),
+                  "recipe_ids": self.recipe_ids, "recipe_names": self.recipe_names, "vocabulary": self.vocabulary,
+                  "indptr": self.indptr, "indices": self.indices, "parsed": self.parsed,
+                  "attribute_names": np.array(list(self.attributes), dtype=str)}
+        for position, values in enumerate(self.attributes.values()):
+            arrays[f"attribute_{position}"] = values
+        _atomic_write(path, lambda target: np.savez(target, **arrays))
+
+    @classmethod
+    def load(cls, path) -> "RecipeCatalog":
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != CATALOG_VERSION:
+                raise ValueError(f"Catalog at {path} was compiled by another version")
+            attributes = {str(name): arrays[f"attribute_{position}"]
+                          for position, name in enumerate(arrays["attribute_names"])}
+            return cls(arrays["recipe_ids"], arrays["recipe_names"], arrays["vocabulary"], arrays["indptr"],
+                       arrays["indices"], arrays["parsed"], attributes, str(arrays["digest"]))
+
+
+def load_catalog(recipes_path, cache_dir=CACHE_DIR, available_products: Iterable[str] = None) -> RecipeCatalog:
+    """Load the compiled catalog of a recipes CSV, compiling and caching it first if the file is new or changed.
+    If available_products is given, only the recipes that can be made from them are returned.
+    With cache_dir=None the file is compiled without caching, dropping unusable recipes while it is read."""
+    if not os.path.exists(recipes_path):
+        raise FileNotFoundError(f"Recipes dataset not found at {recipes_path}")
+    if cache_dir is None:
+        return RecipeCatalog.from_csv(recipes_path, available_products=available_products)
+
+    digest = file_digest(recipes_path, cache_dir)
+    catalog_path = os.path.join(cache_dir, "catalogs", f"{digest}.npz")
+    catalog = None
+    if os.path.exists(catalog_path):
+        try:
+            catalog = RecipeCatalog.load(catalog_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Recompiling recipes catalog for {recipes_path}: {e}")
+    if catalog is None:
+        catalog = RecipeCatalog.from_csv(recipes_path, digest)
+        os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+        catalog.save(catalog_path)
+    return catalog.restrict_to(available_products) if available_products is not None else catalog
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+class ExpiryCalendar:
+    """The products of a pantry bucketed by the day they expire.
+    A state keeps the number of in stock products of every bucket up to date as its quantities change, so counting
+    the products that expire before a day only adds up the buckets before it, whatever the size of the pantry."""
+
+    def __init__(self, expiration_days: np.ndarray):
+        # Distinct expiration days in increasing order, and the bucket of every product
+        self.days, self.buckets = np.unique(expiration_days, return_inverse=True)
+        self.buckets = self.buckets.reshape(-1).astype(np.int64)
+
+    def __len__(self):
+        return len(self.days)
+
+    def count_in_stock(self, quantities: np.ndarray) -> np.ndarray:
+        """Number of products of every bucket with a positive quantity"""
+        return np.bincount(self.buckets[quantities > 0], minlength=len(self.days)).astype(np.int64)
+
+    def count_before(self, counts: np.ndarray, day) -> int:
+        """Number of in stock products, given their counts by bucket, that expire before the given day"""
+        return int(counts[:np.searchsorted(self.days, day)].sum())
@@ -1,20 +1,34 @@
-import datetime
+import math
+import os
 from abc import ABC, abstractmethod
 import pandas as pd
-from typing import List, Dict, Any
-import re
-import ast
+import numpy as np
+from scipy import sparse
+from collections import Counter
+from typing import List, Dict, Optional
 
-from ..Problems.utils import Action, Piece
+from ..Problems.catalog import RecipeCatalog
+from ..Problems.expiry_calendar import ExpiryCalendar
+from ..Problems.utils import Action, Piece, Pantry, LegalActionsReport, day_number, parse_dates
+
+# Reasons for dropping a recipe, in the order of the status codes used by reset_legal_actions
+DROP_REASONS = (LegalActionsReport.MISSING_PRODUCT, LegalActionsReport.OUT_OF_STOCK, LegalActionsReport.EXPIRED)
 
 
 class Problem(ABC):
+    # Check every incrementally tracked score against a full recomputation, for debugging
+    check_scores = os.environ.get("MEAL_OPTIMIZER_CHECK_SCORES", "") not in ("", "0")
+
     def __init__(self, actions_dataset, start_date, pieces_with_dates, number_of_days=1, meals_per_day=3,
                  parameters_to_maximize: List[str] = None):
         self.start_date = start_date
         self.action_dataset = actions_dataset
+        self.catalog = actions_dataset if isinstance(actions_dataset, RecipeCatalog) \
+            else RecipeCatalog.from_dataframe(actions_dataset)
         self.pieces_with_dates = pieces_with_dates
+        self.legal_actions_report = None
         self.legal_actions = self.reset_legal_actions()
+        self._index_legal_actions()
         self.requested_amount = number_of_days * meals_per_day
         self.number_of_days = number_of_days
         self.meals_per_day = meals_per_day
@@ -22,66 +36,308 @@ class Problem(ABC):
     def get_meals_per_day(self):
         return self.meals_per_day
 
+    def _index_products(self):
+        """Index the pantry by product name into per product arrays of int32 day offsets from the start date.
+        The expiration date of recipe pieces is taken from the first row of a product, like the recipes always did,
+        while the pantry_* arrays describe the last row, which is the one State keeps when a product is listed more
+        than once."""
+        names = self.pieces_with_dates["Product Name"]
+        days = parse_dates(self.pieces_with_dates["Date"])
+        if "Quantity" in self.pieces_with_dates.columns:
+            quantities = pd.to_numeric(self.pieces_with_dates["Quantity"]).astype(int).to_numpy()
+        else:
+            quantities = np.ones(len(names), dtype=np.int64)
+        pantry, self.pantry_quantities = Pantry.from_columns(names, days, quantities)
+        first_days = days[~names.duplicated(keep="first").to_numpy()]
+
+        self.start_day = day_number(self.start_date)
+        self.product_names: List[str] = pantry.names
+        self.product_index: Dict[str, int] = pantry.index
+        self.pantry_expiration_days = pantry.expiration_days - np.int32(self.start_day)
+        self.product_expiration_days = first_days - np.int32(self.start_day)
+        self.expiry_calendar = ExpiryCalendar(self.pantry_expiration_days)
+        # Recipes share one piece per product instead of each holding its own copy of the expiration date
+        self.product_pieces = [Piece(name, 1, expiration_day=day)
+                               for name, day in zip(self.product_names, first_days.tolist())]
+        self._last_pantry = None
+        self._last_pantry_columns = None
+
+    def _product_statuses(self, vocabulary_columns) -> np.ndarray:
+        """Status code of every catalog product: 0 if usable, otherwise 1 + its index in DROP_REASONS"""
+        known = vocabulary_columns >= 0
+        statuses = np.ones(len(vocabulary_columns), dtype=np.int8)
+        statuses[known] = np.select([self.pantry_quantities[vocabulary_columns[known]] < 1,
+                                     self.product_expiration_days[vocabulary_columns[known]] <= 0], [2, 3], 0)
+        return statuses
+
     def reset_legal_actions(self) -> List[Action]:
-        legal_actions = []
-        for index, row in self.action_dataset.iterrows():
-            pieces = []
-            is_all_products_exist = True
-
-            # Extract products from the 'Products' column using ast.literal_eval
-            try:
-                products = ast.literal_eval(row['Products'])
-            except Exception as e:
-                print(f"Error parsing products list at index {index}: {e}")
-                continue
-
-            # Process each product
-            for product in products:
-                try:
-                    name = product.strip()
-                    quantity = 1
-
-                    if name not in self.pieces_with_dates["Product Name"].values:
-                        # print(f"Product not found in dataset: {name}")
-                        is_all_products_exist = False
-                        break
-
-                    expiration_date = self.pieces_with_dates[self.pieces_with_dates["Product Name"] == name]["Date"].values[0]
-                    piece = Piece(name, quantity, expiration_date)
-                    pieces.append(piece)
-                except Exception as e:
-                    print(f"Error processing product '{product}' at index {index}: {e}")
-                    is_all_products_exist = False
-                    break
-
-            if not is_all_products_exist:
-                continue
-
-            action = Action(row["Recipe ID"], row["Recipe Name"], pieces)
-            legal_actions.append(action)
+        """Build an action for every recipe whose products are all in the pantry, in stock and not yet expired,
+        together with the recipe x product incidence matrix of those actions.
+        Products are resolved once per catalog product through a name index of the pantry, so this is linear in the
+        catalog size."""
+        self._index_products()
+        catalog = self.catalog
+        vocabulary_columns = np.array([self.product_index.get(name, -1) for name in catalog.vocabulary.tolist()],
+                                      dtype=np.int64)
+        statuses = self._product_statuses(vocabulary_columns)[catalog.indices]
+        recipe_of_product = np.repeat(np.arange(len(catalog)), np.diff(catalog.indptr))
+
+        # Like the original row by row scan, a recipe is dropped for the first product that fails
+        failed = np.flatnonzero(statuses)
+        failed_recipes, first = np.unique(recipe_of_product[failed], return_index=True)
+        first_failure = statuses[failed[first]]
+        legal = catalog.parsed.copy()
+        legal[failed_recipes] = False
+
+        # Recipes the catalog dropped when it was restricted to the pantry count as dropped here
+        dropped = {LegalActionsReport.PARSE_ERROR: int((~catalog.parsed).sum())}
+        for code, reason in enumerate(DROP_REASONS, 1):
+            dropped[reason] = int((first_failure == code).sum())
+        for reason, count in catalog.dropped.items():
+            dropped[reason] = dropped.get(reason, 0) + count
+        missing_products = catalog.vocabulary[catalog.indices[failed[first][first_failure == 1]]]
+        self.legal_actions_report = LegalActionsReport(len(catalog) + sum(catalog.dropped.values()),
+                                                       int(legal.sum()), dropped,
+                                                       Counter(missing_products.tolist()) + catalog.missing_products)
 
+        # Rows are legal recipes and columns are pantry products. A product listed twice in a recipe is used once:
+        # a recipe could always be made with one of it in stock, and the solvers that model the quantities used
+        # would otherwise count it twice.
+        recipes = np.flatnonzero(legal)
+        # Catalog row of every legal action
+        self.action_recipes = recipes
+        lengths = np.diff(catalog.indptr)[recipes]
+        starts = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=starts[1:])
+        positions = np.repeat(catalog.indptr[recipes] - starts[:-1], lengths) + np.arange(starts[-1])
+        columns = vocabulary_columns[catalog.indices[positions]]
+        rows = np.repeat(np.arange(len(recipes)), lengths)
+        first = np.zeros(len(columns), dtype=bool)
+        first[np.unique(rows * len(self.product_names) + columns, return_index=True)[1]] = True
+        columns, rows = columns[first], rows[first]
+        indptr = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(recipes)), out=indptr[1:])
+        self.incidence = sparse.csr_matrix((np.ones(len(columns)), columns, indptr),
+                                           shape=(len(recipes), len(self.product_names)))
+
+        recipe_ids = catalog.recipe_ids[recipes].tolist()
+        recipe_names = catalog.recipe_names[recipes].tolist()
+        legal_actions = []
+        for index in range(len(recipes)):
+            pieces = [self.product_pieces[column] for column in columns[indptr[index]:indptr[index + 1]].tolist()]
+            legal_actions.append(Action(recipe_ids[index], recipe_names[index], pieces, index))
         return legal_actions
 
+    def _index_legal_actions(self):
+        """Precompute per action vectors from the incidence matrix, and index the actions by the products they use
+        and by the first day they can no longer be made"""
+        self.action_sizes = np.asarray(self.incidence.sum(axis=1)).ravel()
+        # Sum over the pieces of every action of 1 / (days until the piece expires + 1)
+        with np.errstate(divide="ignore"):
+            # Products expiring before the start date are in no legal action, so their division by zero is unused
+            self.action_urgency = self.incidence @ (1 / (self.product_expiration_days + 1))
+        self.actions_by_product = self.incidence.tocsc()
+        # An action can be made while the current day is before the expiration of all its pieces
+        expiration = np.full(len(self.legal_actions), np.iinfo(np.int32).max, dtype=np.int32)
+        non_empty = np.diff(self.incidence.indptr) > 0
+        if non_empty.any():
+            product_expiration = self.product_expiration_days[self.incidence.indices]
+            expiration[non_empty] = np.minimum.reduceat(product_expiration, self.incidence.indptr[:-1][non_empty])
+        self.action_expiration_days = expiration
+        self._actions_by_expiration = np.argsort(expiration, kind="stable")
+        self._sorted_expiration = expiration[self._actions_by_expiration]
+
+    def slots_before_expiration(self, indices: np.ndarray) -> np.ndarray:
+        """Number of meal slots from the start of the plan in which each of the given actions can be made"""
+        return self.action_expiration_days[indices].astype(np.int64) * self.meals_per_day
+
+    def repeat_limits(self, state, indices: np.ndarray) -> np.ndarray:
+        """Most times each of the given actions can still be added to the state: as often as its products last, and
+        as there are meal slots left before it expires"""
+        selected = len(state.selected_actions)
+        remaining = max(self.number_of_days * self.meals_per_day - selected, 0)
+        rows = self.incidence[indices]
+        # Every action uses one piece of each of its products
+        repeats = self.state_quantities(state)[rows.indices].astype(np.int64)
+        non_empty = np.diff(rows.indptr) > 0
+        limits = np.full(len(indices), remaining, dtype=np.int64)
+        limits[non_empty] = np.minimum.reduceat(repeats, rows.indptr[:-1][non_empty])
+        return np.clip(np.minimum(limits, self.slots_before_expiration(indices) - selected), 0, remaining)
+
+    def _pantry_columns(self, pantry) -> Optional[np.ndarray]:
+        """Column of every product of the problem in the pantry of a state, or None if the pantry lists the same
+        products in the same order, which it does whenever both were built from the same products table"""
+        if pantry is not self._last_pantry:
+            self._last_pantry = pantry
+            self._last_pantry_columns = None if pantry.names == self.product_names else \
+                np.array([pantry.index.get(name, -1) for name in self.product_names], dtype=np.int64)
+        return self._last_pantry_columns
+
+    def state_quantities(self, state) -> np.ndarray:
+        """Quantity of every pantry product in the state"""
+        columns = self._pantry_columns(state.pantry)
+        quantities = state.quantities
+        return quantities if columns is None else np.where(columns >= 0, quantities[columns], 0)
+
+    def _feasible_actions(self, quantities, current_day) -> np.ndarray:
+        """Which actions can be made on the given day: one sparse product counts the usable pieces of every action"""
+        usable = (quantities >= 1) & (self.product_expiration_days > current_day)
+        return self.incidence @ usable.astype(np.float64) == self.action_sizes
+
+    def _is_available_action(self, index, state, current_day) -> bool:
+        return self.action_expiration_days[index] > current_day and \
+            all(state.is_there_enough(piece) for piece in self.legal_actions[index].pieces)
+
+    def is_available_action(self, action: Action, state, day: Optional[int] = None) -> bool:
+        """Can the action be made on the given day, the current day of the state by default, with the current
+        quantities of the state"""
+        return self._is_available_action(action.index, state, self.current_day(state) if day is None else day)
+
+    def sample_available_action(self, state, day: int, generator, attempts: int = 8) -> Optional[Action]:
+        """A random action that can be made on the given day, at most the current day of the state, with the
+        current quantities of the state, or None if there is none.
+        Actions are first drawn from the ones that have not expired by that day, a slice of the actions in order of
+        expiration, until one is in stock. If none is, the action is drawn from the feasible actions cached on the
+        state, which can all be made on the current day and so on any day before it."""
+        first = int(np.searchsorted(self._sorted_expiration, day, "right"))
+        if first == len(self._sorted_expiration):
+            return None
+        for _ in range(attempts):
+            index = int(self._actions_by_expiration[generator.randrange(first, len(self._sorted_expiration))])
+            if self._is_available_action(index, state, day):
+                return self.legal_actions[index]
+        feasible = np.flatnonzero(self._update_feasible_actions(state, self.current_day(state)))
+        if not len(feasible):
+            return None
+        return self.legal_actions[int(feasible[generator.randrange(len(feasible))])]
+
+    def _update_feasible_actions(self, state, current_day) -> np.ndarray:
+        """Bring the feasible actions cached on the state up to date. Only the actions that use a product whose
+        quantity changed, or that expired since the last update, are checked again."""
+        feasible = state.feasible_actions
+        if feasible is None or state.feasible_problem is not self or current_day < state.feasible_day:
+            feasible = self._feasible_actions(self.state_quantities(state), current_day)
+        else:
+            if state.feasible_shared:
+                feasible = feasible.copy()
+            if current_day > state.feasible_day:
+                expired = slice(np.searchsorted(self._sorted_expiration, state.feasible_day, "right"),
+                                np.searchsorted(self._sorted_expiration, current_day, "right"))
+                feasible[self._actions_by_expiration[expired]] = False
+            by_product = self.actions_by_product
+            for name in state.changed_products:
+                column = self.product_index.get(name)
+                if column is None:
+                    continue
+                for index in by_product.indices[by_product.indptr[column]:by_product.indptr[column + 1]].tolist():
+                    feasible[index] = self._is_available_action(index, state, current_day)
+        state.feasible_actions = feasible
+        state.feasible_shared = False
+        state.feasible_problem = self
+        state.feasible_day = current_day
+        state.changed_products.clear()
+        return feasible
+
+    def count_expiring_bound(self, state, lengths: np.ndarray, removable: np.ndarray,
+                             usable: np.ndarray) -> np.ndarray:
+        """Lower bound of count_expiring_pieces for plans that extend the state to each of the given lengths, when
+        only the products marked usable can still be used, and at most removable[i] of them can run out on the way.
+        Products that cannot be used stay in stock, and each one that runs out takes a use of it."""
+        quantities = self.state_quantities(state)
+        in_stock = quantities > 0
+        tomorrow_days = 1 + lengths // self.meals_per_day
+        stuck = np.searchsorted(np.sort(self.pantry_expiration_days[in_stock & ~usable]), tomorrow_days)
+        at_risk = np.searchsorted(np.sort(self.pantry_expiration_days[in_stock & usable]), tomorrow_days)
+        return stuck + np.maximum(at_risk - removable, 0)
+
+    def current_day(self, state) -> int:
+        """Day of the plan the next meal of the state is on, counted from the start date"""
+        return len(state.selected_actions) // self.meals_per_day
+
+    def _expiry_counts(self, state) -> Optional[np.ndarray]:
+        """In stock products of the state by bucket of the expiry calendar, or None if its pantry lists other
+        products than the problem"""
+        if state.expiry_calendar is not self.expiry_calendar:
+            if self._pantry_columns(state.pantry) is not None:
+                return None
+            state.expiry_calendar = self.expiry_calendar
+            state.expiry_counts = self.expiry_calendar.count_in_stock(state.quantities)
+        return state.expiry_counts
+
+    def count_expiring_pieces(self, state) -> int:
+        """Number of pantry products still in stock that expire before tomorrow"""
+        tomorrow_day = 1 + self.current_day(state)
+        counts = self._expiry_counts(state)
+        if counts is not None:
+            return self.expiry_calendar.count_before(counts, tomorrow_day)
+        quantities = self.state_quantities(state)
+        return int(np.count_nonzero((quantities > 0) & (self.pantry_expiration_days < tomorrow_day)))
+
     @abstractmethod
     def get_action_score(self, action, state) -> float:
         """Action is selected recipe"""
         pass
 
+    @property
+    def action_weights(self) -> Optional[np.ndarray]:
+        """Part of the score of every legal action that does not depend on the state, for problems that score an
+        action as its weight plus state_score(state). None if the score of an action does not split like this."""
+        return None
+
+    def state_score(self, state) -> float:
+        """Part of the score of an action that depends only on the state"""
+        return 0.0
+
+    def expiring_score(self, expiring_count):
+        """State term of a state with the given number of expiring pieces, for problems whose state term depends
+        only on it. Works on arrays of counts too."""
+        return expiring_count * 0.0
+
+    def state_score_bounds(self, state, lengths: np.ndarray, removable: np.ndarray,
+                           usable: np.ndarray) -> np.ndarray:
+        """Upper bound of state_score for plans that extend the state to each of the given lengths, see
+        count_expiring_bound for the other arguments"""
+        return np.zeros(len(lengths))
+
+    def score_actions(self, actions: List[Action], state) -> np.ndarray:
+        """Scores of all the given actions in the same state, as get_action_score would give them one by one"""
+        weights = self.action_weights
+        if weights is None:
+            return np.array([self.get_action_score(action, state) for action in actions], dtype=np.float64)
+        return weights[[action.index for action in actions]] + self.state_score(state)
+
     def get_available_actions(self, state) -> List[Action]:
         """State is all available products and used recipes, meaning available moves are all the recipes
         that can be made with the available products minus products used by recipes"""
-        meals_cooked = len(state.selected_actions)
-        current_date = self.start_date + datetime.timedelta(days=meals_cooked // self.meals_per_day)
-        available_actions = []
-        for action in self.legal_actions:
-            if all(state.is_available_piece(piece, current_date) for piece in action.pieces):
-                available_actions.append(action)
-        return available_actions
+        current_day = self.current_day(state)
+        feasible = self._update_feasible_actions(state, current_day)
+        return [self.legal_actions[index] for index in np.flatnonzero(feasible).tolist()]
 
     def get_score(self, state) -> float:
-        """Calculate the score of the current state"""
-        return sum(self.get_action_score(action, state) for action in state.selected_actions)
+        """Calculate the score of the current state.
+        When actions score as a weight plus a state term, the state keeps the sum of the weights of its selected
+        actions up to date as they are added and removed, so this does not depend on the length of the plan."""
+        if self.action_weights is None:
+            return self.recompute_score(state)
+        score = self.selected_weight(state) + len(state.selected_actions) * self.state_score(state)
+        if self.check_scores:
+            expected = self.recompute_score(state)
+            if not math.isclose(score, expected, rel_tol=1e-9, abs_tol=1e-9):
+                raise RuntimeError(f"Incremental score {score} differs from the recomputed score {expected}")
+        return score
+
+    def selected_weight(self, state) -> float:
+        """Sum of the action weights of the selected actions of the state"""
+        weights = self.action_weights
+        if state.score_weights is not weights:
+            state.score_weights = weights
+            state.weight_sum = float(weights[state.selected_action_ids].sum())
+        return state.weight_sum
+
+    def recompute_score(self, state) -> float:
+        """Score of the state computed from scratch by scoring every selected action"""
+        return sum(self.score_actions(state.selected_actions, state).tolist())
 
     def is_goal_state(self, state) -> bool:
         """Have we reached the requested amount of recipes"""
-        return len(state.selected_actions) >= self.number_of_days * self.meals_per_day or not state.get_available_pieces
+        return len(state.selected_actions) >= self.number_of_days * self.meals_per_day or len(state.pantry) == 0
@@ -1,6 +1,8 @@
-import datetime
+from functools import cached_property
 from typing import List
 
+import numpy as np
+
 from .state import State
 from .utils import Action
 from ..Problems import Problem
@@ -16,19 +18,23 @@ class MinimizeWasteProblem(Problem):
         meaning the closer the expiration date the higher the score.
         The goal is to minimize waste, so we want to use products that are closer to expiration date.
         """
+        return self.score_actions([action], state)[0]
+
+    @property
+    def action_weights(self) -> np.ndarray:
+        return self.action_urgency
+
+    def state_score(self, state: State = None) -> float:
         if state is None:
             raise RuntimeError("State is required for this problem.")
-        expired_count = 0
-        meals_cooked = len(state.selected_actions)
-        tomorrow_date = self.start_date + datetime.timedelta(days=1 + (meals_cooked // self.meals_per_day))
-        for piece in state.get_available_pieces:
-            if piece.expiration_date < tomorrow_date and piece.quantity > 0 and piece not in action.pieces:
-                expired_count += 1
+        return self.expiring_score(self.count_expiring_pieces(state))
 
-        score = 0
-        for piece in action.pieces:
-            score += 1 / ((piece.expiration_date - self.start_date).days + 1)
-        return score+1/(expired_count+1)
+    def state_score_bounds(self, state: State, lengths: np.ndarray, removable: np.ndarray,
+                           usable: np.ndarray) -> np.ndarray:
+        return self.expiring_score(self.count_expiring_bound(state, lengths, removable, usable))
+
+    def expiring_score(self, expiring_count):
+        return 1 / (expiring_count + 1)
 
 
 class CountExpiredItemsProblem(Problem):
@@ -37,16 +43,23 @@ class CountExpiredItemsProblem(Problem):
         Score is the negative count of items that would expire if not used in this action.
         The goal is to minimize the number of expired items.
         """
+        return self.score_actions([action], state)[0]
+
+    @cached_property
+    def action_weights(self) -> np.ndarray:
+        return np.zeros(len(self.legal_actions))
+
+    def state_score(self, state: State = None) -> float:
         if state is None:
             raise RuntimeError("State is required for this problem.")
-        expired_count = 0
-        meals_cooked = len(state.selected_actions)
-        tomorrow_date = self.start_date + datetime.timedelta(days=1 + (meals_cooked // self.meals_per_day))
-        for piece in state.get_available_pieces:
-            if piece.expiration_date < tomorrow_date and piece.quantity > 0 and piece not in action.pieces:
-                expired_count += 1
+        return self.expiring_score(self.count_expiring_pieces(state))
 
-        return 1 / (expired_count + 1)
+    def state_score_bounds(self, state: State, lengths: np.ndarray, removable: np.ndarray,
+                           usable: np.ndarray) -> np.ndarray:
+        return self.expiring_score(self.count_expiring_bound(state, lengths, removable, usable))
+
+    def expiring_score(self, expiring_count):
+        return 1 / (expiring_count + 1)
 
 
 class ParametersProblem(Problem):
@@ -57,21 +70,30 @@ class ParametersProblem(Problem):
 
         # Validate that all specified parameters exist in the dataset
         for param in self.parameters_to_maximize:
-            if param not in self.action_dataset.columns:
+            if param not in self.catalog.attributes:
                 raise ValueError(f"Parameter '{param}' not found in the action dataset.")
 
         # Normalize the parameters
         self.normalized_parameters = self._normalize_parameters()
+        # Normalized parameters of every legal action, one column per parameter, and the sign each one is scored with
+        self.parameter_matrix = np.column_stack(
+            [self.normalized_parameters[param][self.action_recipes] for param in self.parameters_to_maximize]
+        ) if self.parameters_to_maximize else np.zeros((len(self.legal_actions), 0))
+        self.parameter_signs = np.array([1.0 if param in MAX_PARAMETERS else -1.0 if param in MIN_PARAMETERS else 0.0
+                                         for param in self.parameters_to_maximize])
+        self.parameter_scores = self.parameter_matrix @ self.parameter_signs
 
     def _normalize_parameters(self):
+        """Scale every parameter by its range over the whole recipes catalog, also when the catalog was restricted
+        to the pantry, so the scores do not depend on which recipes the pantry allows"""
         normalized = {}
         for param in self.parameters_to_maximize:
-            min_val = self.action_dataset[param].min()
-            max_val = self.action_dataset[param].max()
-            if min_val == max_val:
-                normalized[param] = self.action_dataset[param].apply(lambda x: 1)
+            values = self.catalog.attributes[param]
+            min_val, max_val = self.catalog.attribute_ranges[param]
+            if not min_val < max_val:
+                normalized[param] = np.ones_like(values)
             else:
-                normalized[param] = (self.action_dataset[param] - min_val) / (max_val - min_val)
+                normalized[param] = (values - min_val) / (max_val - min_val)
         return normalized
 
     def get_score_by_minimize(self, action: Action, param) -> float:
@@ -79,27 +101,17 @@ class ParametersProblem(Problem):
         Score is the sum of the normalized values of the specified parameters for the given action.
         The goal is to minimize these parameters.
         """
-        score = 0
-        for piece in action.pieces:
-            score += 1 / ((piece.expiration_date - self.start_date).days + 1)
-
-        normalized_value = self.normalized_parameters[param][self.action_dataset['Recipe ID'] == action.action_id].values[0]
-        score += normalized_value
+        score = self.action_urgency[action.index]
+        score += self.normalized_parameters[param][self.action_recipes[action.index]]
+        return score
 
     def get_action_score(self, action: Action, state: State = None) -> float:
         """
         Score is the sum of the normalized values of the specified parameters for the given action.
         The goal is to maximize these parameters.
         """
-        score = 0
-        for piece in action.pieces:
-            score += 1 / ((piece.expiration_date - self.start_date).days + 1)
+        return self.action_weights[action.index]
 
-        for param in self.parameters_to_maximize:
-            if param in MAX_PARAMETERS:
-                normalized_value = self.normalized_parameters[param][self.action_dataset['Recipe ID'] == action.action_id].values[0]
-                score += normalized_value
-            elif param in MIN_PARAMETERS:
-                normalized_value = self.normalized_parameters[param][self.action_dataset['Recipe ID'] == action.action_id].values[0]
-                score -= normalized_value
-        return score
+    @cached_property
+    def action_weights(self) -> np.ndarray:
+        return self.action_urgency + self.parameter_scores
@@ -1,7 +1,12 @@
-import copy
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 
-from ..Problems.utils import Action, Piece
+import numpy as np
+import pandas as pd
+
+from ..Problems.utils import Action, Piece, Pantry, NO_EXPIRATION
+
+# A state folds its changed quantities into a new array once they cover this share of the pantry
+COMPACT_FRACTION = 8
 
 
 class State:
@@ -9,29 +14,108 @@ class State:
         if selected_actions is None:
             selected_actions = []
         self.selected_actions: List[Action] = selected_actions.copy()
-        self.available_pieces: Dict[str, Piece] = {piece.item_id: piece for piece in copy.deepcopy(available_pieces)}
+        self.pantry, self._base_quantities = Pantry.from_pieces(available_pieces)
+        self._reset_caches()
+
+    def _reset_caches(self):
+        # Quantities that differ from the base array, which is shared with copies and never written
+        self._changed_quantities: Dict[int, int] = {}
+        # Feasible actions of the last problem that asked, kept up to date by Problem.get_available_actions
+        self.feasible_actions: Optional[np.ndarray] = None
+        self.feasible_shared = False
+        self.feasible_problem = None
+        self.feasible_day = None
+        # Products whose quantity changed since the feasible actions were last updated
+        self.changed_products: Set[str] = set()
+        # In stock products by expiration day of the calendar of the last problem that asked, kept up to date here
+        self.expiry_calendar = None
+        self.expiry_counts: Optional[np.ndarray] = None
+        # Sum of the action weights of the selected actions for the last problem that asked, see Problem.get_score
+        self.score_weights: Optional[np.ndarray] = None
+        self.weight_sum = 0.0
+
+    @classmethod
+    def from_dataframe(cls, products: pd.DataFrame, selected_actions=None) -> "State":
+        """State of a products table, its dates are parsed a column at a time instead of piece by piece"""
+        state = cls.__new__(cls)
+        state.selected_actions = list(selected_actions or [])
+        state.pantry, state._base_quantities = Pantry.from_dataframe(products)
+        state._reset_caches()
+        return state
+
+    def quantity(self, item_id) -> int:
+        column = self.pantry.index.get(item_id)
+        if column is None:
+            return 0
+        return self._changed_quantities.get(column, self._base_quantities[column])
+
+    def set_quantity(self, item_id, quantity) -> None:
+        column = self.pantry.index[item_id]
+        if self.expiry_counts is not None and (self.quantity(item_id) > 0) != (quantity > 0):
+            self.expiry_counts[self.expiry_calendar.buckets[column]] += 1 if quantity > 0 else -1
+        self._changed_quantities[column] = quantity
+        self.changed_products.add(item_id)
+        if len(self._changed_quantities) * COMPACT_FRACTION > len(self.pantry):
+            self._base_quantities = self.quantities
+            self._changed_quantities = {}
+
+    @property
+    def quantities(self) -> np.ndarray:
+        """Quantity of every product of the pantry, as a new array"""
+        quantities = self._base_quantities.copy()
+        if self._changed_quantities:
+            quantities[list(self._changed_quantities)] = list(self._changed_quantities.values())
+        return quantities
 
     def update_state(self, action) -> None:
         """Remove from available pieces all pieces used in the selected action"""
-        self.selected_actions.append(action)
+        self.insert_action(len(self.selected_actions), action)
+
+    def insert_action(self, position, action) -> None:
+        """Select the action at the given position and remove its pieces, the opposite of remove_action"""
+        self.selected_actions.insert(position, action)
+        if self.score_weights is not None:
+            self.weight_sum += self.score_weights[action.index]
         for piece in action.pieces:
             if self.is_there_enough(piece):
-                self.available_pieces[piece.item_id].quantity -= piece.quantity
+                self.set_quantity(piece.item_id, self.quantity(piece.item_id) - piece.quantity)
+
+    def remove_action(self, position) -> Action:
+        """Remove the selected action at the given position and put its pieces back"""
+        action = self.selected_actions.pop(position)
+        if self.score_weights is not None:
+            self.weight_sum -= self.score_weights[action.index]
+        for piece in action.pieces:
+            if piece.item_id in self.pantry.index:
+                self.set_quantity(piece.item_id, self.quantity(piece.item_id) + piece.quantity)
+        return action
 
     def is_there_enough(self, piece):
-        return piece.item_id in self.available_pieces and self.available_pieces[piece.item_id].quantity >= piece.quantity
+        return self.quantity(piece.item_id) >= piece.quantity
 
-    def is_available_piece(self, piece, current_date) -> bool:
-        """Check if the piece is available in the current state"""
-        return self.is_there_enough(piece) and piece.expiration_date > current_date
+    def is_available_piece(self, piece, current_day) -> bool:
+        """Check if the piece is available in the current state, current_day is a day number like the expiration"""
+        return self.is_there_enough(piece) and piece.expiration_day > current_day
 
     @property
     def get_selected_actions(self):
         return self.selected_actions
 
+    @property
+    def selected_action_ids(self) -> np.ndarray:
+        """Positions of the selected actions in the legal actions of their problem"""
+        return np.array([action.index for action in self.selected_actions], dtype=np.int64)
+
+    @property
+    def available_pieces(self) -> Dict[str, Piece]:
+        return {piece.item_id: piece for piece in self.get_available_pieces}
+
     @property
     def get_available_pieces(self):
-        return list(self.available_pieces.values())
+        """Pieces built from the current quantities, changing them does not change the state"""
+        return [Piece(name, quantity, expiration_day=None if expiration_day == NO_EXPIRATION else expiration_day)
+                for name, quantity, expiration_day in
+                zip(self.pantry.names, self.quantities.tolist(), self.pantry.expiration_days.tolist())]
 
     def __repr__(self):
         selected_recipes = "\n".join([action.name for action in self.selected_actions])
@@ -40,4 +124,21 @@ class State:
         return f"Selected recipes: \n{selected_recipes} \nProducts used: \n{pieces_used}"
 
     def __copy__(self):
-        return State(list(self.available_pieces.values()), self.selected_actions)
+        """Snapshot of the state. The pantry and quantity arrays are shared and only the changed quantities are
+        copied, so a copy costs the number of changed products, not the size of the pantry."""
+        state = State.__new__(State)
+        state.selected_actions = self.selected_actions.copy()
+        state.pantry = self.pantry
+        state._base_quantities = self._base_quantities
+        state._changed_quantities = self._changed_quantities.copy()
+        state.feasible_actions = self.feasible_actions
+        state.feasible_problem = self.feasible_problem
+        state.feasible_day = self.feasible_day
+        state.changed_products = self.changed_products.copy()
+        state.expiry_calendar = self.expiry_calendar
+        state.expiry_counts = None if self.expiry_counts is None else self.expiry_counts.copy()
+        state.score_weights = self.score_weights
+        state.weight_sum = self.weight_sum
+        # The feasible actions are copied by whichever state updates them first
+        state.feasible_shared = self.feasible_shared = self.feasible_actions is not None
+        return state
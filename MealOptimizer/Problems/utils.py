@@ -1,33 +1,153 @@
 import copy
 import datetime
-from typing import List
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+# Dates are stored as int32 day numbers counted from EPOCH, pieces without a date never expire
+EPOCH = datetime.date(1970, 1, 1)
+NO_EXPIRATION = np.iinfo(np.int32).max
+
+
+def parse_date(value) -> datetime.date:
+    """Parse an expiration date given as a date, datetime or string in one of DATE_FORMATS"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    # If none of the formats match, raise an error
+    raise ValueError(f"Invalid date format: {value}")
+
+
+def day_number(value) -> int:
+    """Day number of a date given in any form parse_date accepts"""
+    return (parse_date(value) - EPOCH).days
+
+
+def parse_dates(values) -> np.ndarray:
+    """Parse a whole column of dates at once into int32 day numbers, trying each of DATE_FORMATS in turn"""
+    values = pd.Series(values, dtype=object).reset_index(drop=True)
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(values[missing], format=fmt, errors="coerce")
+    invalid = parsed.isna()
+    if invalid.any():
+        raise ValueError(f"Invalid date format: {values[invalid].iloc[0]}")
+    return parsed.to_numpy().astype("datetime64[D]").astype(np.int32)
 
 
 class Piece:
-    def __init__(self, item_id, quantity, expiration_date=None):
+    __slots__ = ("item_id", "quantity", "expiration_day")
+
+    def __init__(self, item_id, quantity, expiration_date=None, expiration_day=None):
         self.item_id = item_id
         self.quantity = int(quantity)
-        # Format date time
+        # Day number of the expiration date, given either as a date or directly as a day number
         if expiration_date:
-            for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
-                try:
-                    self.expiration_date = datetime.datetime.strptime(expiration_date, fmt).date()
-                    break
-                except ValueError:
-                    continue
-            else:
-                # If none of the formats match, raise an error
-                raise ValueError(f"Invalid date format: {expiration_date}")
+            expiration_day = day_number(expiration_date)
+        self.expiration_day = expiration_day
+
+    @property
+    def expiration_date(self) -> datetime.date:
+        if self.expiration_day is None:
+            return None
+        return EPOCH + datetime.timedelta(days=int(self.expiration_day))
 
     def __hash__(self):
-        return hash((self.item_id, self.quantity, self.expiration_date))
+        return hash((self.item_id, self.quantity, self.expiration_day))
 
 
 class Action:
-    def __init__(self, action_id, name, pieces: List[Piece]):
+    __slots__ = ("action_id", "name", "pieces", "index")
+
+    def __init__(self, action_id, name, pieces: List[Piece], index=None):
         self.action_id = action_id
         self.name = name
         self.pieces = pieces
+        # Position of the action in the legal actions of its problem
+        self.index = index
 
     def __hash__(self):
         return hash((self.action_id, self.name, tuple(self.pieces)))
+
+
+class Pantry:
+    """The products a state can hold, shared by a state and every state copied from it.
+    When a product is listed more than once its first position is kept with the date of its last listing."""
+
+    def __init__(self, names: List[str], expiration_days: np.ndarray):
+        self.names = names
+        # Day number of the expiration date of every product, NO_EXPIRATION if it has none
+        self.expiration_days = expiration_days
+        self.index: Dict[str, int] = {name: column for column, name in enumerate(names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_pieces(cls, pieces: List[Piece]):
+        """The pantry of the given pieces and the quantity of every product in it"""
+        latest = {piece.item_id: piece for piece in pieces}
+        expiration_days = [NO_EXPIRATION if piece.expiration_day is None else piece.expiration_day
+                           for piece in latest.values()]
+        pantry = cls(list(latest), np.array(expiration_days, dtype=np.int32))
+        return pantry, np.array([piece.quantity for piece in latest.values()], dtype=np.int64)
+
+    @classmethod
+    def from_columns(cls, names: pd.Series, expiration_days: np.ndarray, quantities: np.ndarray):
+        """The pantry of a products table given as columns, and the quantity of every product in it"""
+        names = names.reset_index(drop=True)
+        first_rows = ~names.duplicated(keep="first")
+        last_rows = ~names.duplicated(keep="last")
+        # Row of the last listing of every product, in the order of the first listings
+        last = pd.Series(np.flatnonzero(last_rows), index=names[last_rows]).reindex(names[first_rows]).to_numpy()
+        pantry = cls(names[first_rows].tolist(), np.asarray(expiration_days, dtype=np.int32)[last])
+        return pantry, np.asarray(quantities, dtype=np.int64)[last]
+
+    @classmethod
+    def from_dataframe(cls, products: pd.DataFrame):
+        """The pantry of a products table with 'Product Name', 'Date' and optionally 'Quantity' columns"""
+        if "Quantity" in products.columns:
+            quantities = pd.to_numeric(products["Quantity"]).astype(int).to_numpy()
+        else:
+            quantities = np.ones(len(products), dtype=np.int64)
+        return cls.from_columns(products["Product Name"], parse_dates(products["Date"]), quantities)
+
+
+class LegalActionsReport:
+    """How many recipes became legal actions, and why the others were dropped"""
+    PARSE_ERROR = "parse_error"
+    MISSING_PRODUCT = "missing_product"
+    OUT_OF_STOCK = "out_of_stock"
+    EXPIRED = "expired"
+
+    def __init__(self, total: int, kept: int, dropped: Dict[str, int], missing_products: Counter):
+        self.total = total
+        self.kept = kept
+        self.dropped = dropped
+        self.missing_products = missing_products
+
+    @property
+    def dropped_count(self) -> int:
+        return sum(self.dropped.values())
+
+    def __repr__(self):
+        reasons = ", ".join(f"{count} {reason.replace('_', ' ')}" for reason, count in self.dropped.items() if count)
+        summary = f"{self.kept} of {self.total} recipes are legal actions"
+        if reasons:
+            summary += f" (dropped: {reasons})"
+        if self.missing_products:
+            most_common = ", ".join(f"{name} ({count})" for name, count in self.missing_products.most_common(5))
+            summary += f"\nMost common missing products: {most_common}"
+        return summary
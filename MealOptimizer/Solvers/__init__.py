@@ -1,4 +1,11 @@
-from .solver import Solver
+from .solver import CancellationToken, Solver
 from .greedy_algorithm import GreedySolver
 from .simulated_annealing_algorithm import SimulatedAnnealingSolver
 from .reinforcement_learning_algorthm import RLSolver
+from .lazy_greedy_algorithm import LazyGreedySolver
+from .beam_search_algorithm import BeamSearchSolver
+from .branch_and_bound_algorithm import BranchAndBoundSolver
+from .milp_algorithm import MILPSolver
+from .multi_start_annealing_algorithm import MultiStartAnnealingSolver
+from .linear_reinforcement_learning_algorithm import LinearRLSolver
+from .mcts_algorithm import MCTSSolver
@@ -0,0 +1,160 @@
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .beam_search_algorithm import BeamSearchSolver
+from .lazy_greedy_algorithm import LazyGreedySolver
+from .solver import Solver, best_sums
+
+
+class BranchAndBoundSolver(Solver):
+    def __init__(self, node_limit: int = 1000000, time_limit: Optional[float] = 60.0, tolerance: float = 1e-9):
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.tolerance = tolerance
+        # Outcome of the last solve: the score of the plan found, an upper bound of the optimal score and whether
+        # the plan was proven optimal
+        self.best_score = None
+        self.upper_bound = None
+        self.gap = None
+        self.proven_optimal = False
+        self.nodes = 0
+
+    def solve(self, problem: Problem, state: State) -> State:
+        """
+        Solve the given problem exactly with a depth first branch and bound over the meal slots.
+        The better of the greedy and beam search plans is the first incumbent, and a partial plan is pruned when
+        the upper bound of every plan that extends it (see upper_bound_of) cannot beat the incumbent.
+        The score of a plan does not depend on the order of its meals, and a plan that can be made in some order
+        can be made in order of expiration, so actions are only added in order of (expiration day, index) and every
+        plan is explored once.
+        If the node or time limit or the deadline is reached, or the solve is cancelled, the best plan found so far
+        is returned, and `gap` tells how far from optimal it can be at most.
+        """
+        if problem.action_weights is None:
+            raise ValueError(f"{type(problem).__name__} does not split its score into action weights.")
+        deadline = self.earliest_deadline(None if self.time_limit is None else time.time() + self.time_limit)
+        # Position of every action in order of expiration
+        ranks = np.empty(len(problem.legal_actions), dtype=np.int64)
+        ranks[np.lexsort((np.arange(len(ranks)), problem.action_expiration_days))] = np.arange(len(ranks))
+
+        best_state = None
+        best_score = -np.inf
+        for heuristic in (LazyGreedySolver(), BeamSearchSolver()):
+            heuristic.configure(deadline, cancellation=self.cancellation)
+            heuristic_state = heuristic.solve(problem, state.__copy__())
+            if problem.get_score(heuristic_state) > best_score:
+                best_state, best_score = heuristic_state, problem.get_score(heuristic_state)
+                self.report_improvement(best_state, best_score)
+
+        # Partial plans to explore, with the bound of their parent and the rank of their last action
+        stack: List[Tuple[float, State, int]] = [(np.inf, state, -1)]
+        self.nodes = 0
+        while stack:
+            if self.nodes >= self.node_limit or (deadline is not None and time.time() > deadline) or \
+                    self.should_stop():
+                break
+            bound, node, last_rank = stack.pop()
+            if bound <= best_score + self.tolerance:
+                continue
+            self.nodes += 1
+
+            available_actions = [] if problem.is_goal_state(node) else problem.get_available_actions(node)
+            if not available_actions:
+                score = problem.get_score(node)
+                if score > best_score:
+                    best_state, best_score = node, score
+                    self.report_improvement(best_state, best_score)
+                continue
+            # Plans with an action that comes earlier in the order are explored from another partial plan
+            children = [action for action in available_actions if ranks[action.index] >= last_rank]
+            if not children:
+                continue
+            bound = self.upper_bound_of(problem, node, children)
+            if bound <= best_score + self.tolerance:
+                continue
+
+            scores = problem.score_actions(children, node)
+            # The best child is pushed last so it is explored first
+            for position in np.argsort(-scores, kind="stable")[::-1].tolist():
+                action = children[position]
+                child = node.__copy__()
+                child.update_state(action)
+                stack.append((bound, child, ranks[action.index]))
+
+        self.best_score = best_score
+        self.upper_bound = max([best_score] + [entry[0] for entry in stack])
+        self.gap = self.upper_bound - best_score
+        self.proven_optimal = not stack
+        return best_state
+
+    def upper_bound_of(self, problem: Problem, state: State, available_actions) -> float:
+        """
+        Upper bound of the score of every plan that extends the state with the given actions.
+        Products are only used up and days only move forward, so every later action is available now, and can be
+        repeated at most as often as its products last and as there are meal slots left before it expires.
+        For every number of added actions, their weights are bounded by the best weights repeated as allowed, and
+        by the best weight per use of the products in stock. The state term is bounded by the products that expire
+        before the end of the plan, less the most products that many actions can use up.
+        """
+        selected = len(state.selected_actions)
+        remaining = problem.number_of_days * problem.meals_per_day - selected
+        indices = np.array([action.index for action in available_actions], dtype=np.int64)
+
+        quantities = problem.state_quantities(state)
+        rows = problem.incidence[indices]
+        repeat_limits = problem.repeat_limits(state, indices)
+        slots_before_expiration = problem.slots_before_expiration(indices)
+
+        weights = problem.action_weights[indices]
+        best_weights = best_sums(weights, repeat_limits, remaining)
+        # Every product can only be used as often as it is in stock, and each use of a product is worth at most the
+        # best weight per product use of the actions that use it
+        uses = np.asarray(rows.sum(axis=1)).ravel()
+        weight_per_use = np.divide(np.maximum(weights, 0), uses, out=np.zeros(len(weights)), where=uses > 0)
+        best_weight_per_use = np.zeros(rows.shape[1])
+        np.maximum.at(best_weight_per_use, rows.indices, np.repeat(weight_per_use, np.diff(rows.indptr)))
+        best_weights = np.minimum(best_weights, float(quantities.astype(np.float64) @ best_weight_per_use))
+
+        # Lengths of the plans the state can still be extended to
+        lengths = selected + np.arange(1, len(best_weights) + 1)
+        removable = best_sums(np.diff(rows.indptr).astype(np.float64), repeat_limits, remaining)
+        usable = np.zeros(rows.shape[1], dtype=bool)
+        usable[rows.indices] = True
+        state_bounds = problem.state_score_bounds(state, lengths, removable[:len(lengths)], usable)
+        bound = float(np.max(best_weights + lengths * state_bounds))
+
+        # The linear relaxation of choosing the added actions, with the best state term for all of them, also
+        # accounts for actions that share products or compete for the slots before they expire
+        state_bound = float(np.max(state_bounds))
+        relaxation = self._relaxation_bound(weights + state_bound, rows, quantities, repeat_limits,
+                                            slots_before_expiration - selected, remaining)
+        return problem.selected_weight(state) + min(bound, selected * state_bound + relaxation)
+
+    @staticmethod
+    def _relaxation_bound(values, rows, quantities, repeat_limits, slots_before_expiration, remaining) -> float:
+        """Highest total value of fractional repeats of the actions within their repeat limits, the remaining slots,
+        the slots before they expire and the stock of their products"""
+        useful = (values > 0) & (repeat_limits > 0)
+        if not useful.any():
+            return 0.0
+        values, rows, repeat_limits = values[useful], rows[useful], repeat_limits[useful]
+        slots_before_expiration = np.minimum(slots_before_expiration[useful], remaining)
+        products = np.unique(rows.indices)
+        deadlines = np.unique(slots_before_expiration)
+        constraints = sparse.vstack([rows[:, products].T,
+                                     sparse.csr_matrix(slots_before_expiration[None, :] <= deadlines[:, None],
+                                                       dtype=np.float64)])
+        limits = np.concatenate([quantities[products], deadlines]).astype(np.float64)
+        result = linprog(-values, A_ub=constraints, b_ub=limits, bounds=np.column_stack([np.zeros(len(values)),
+                                                                                          repeat_limits]),
+                         method="highs")
+        if result.status != 0:
+            return np.inf
+        # Leave room for the feasibility tolerance of the solver
+        return -result.fun + 1e-6
@@ -1,4 +1,7 @@
 from typing import List
+
+import numpy as np
+
 from ..Problems.problem import Problem
 from ..Problems.state import State
 from ..Problems.utils import Action
@@ -9,16 +12,20 @@ class GreedySolver(Solver):
     def solve(self, problem: Problem, state: State) -> State:
         """
         Solve the given problem using a greedy approach and return the solution.
+        Stops early with the plan so far at the deadline or on cancellation.
         """
-        while not problem.is_goal_state(state):
+        best_score = float('-inf')
+        while not problem.is_goal_state(state) and not self.should_stop():
             available_actions = problem.get_available_actions(state)
             if not available_actions:
                 break  # No more actions available, terminate
 
-            # Find the action with the highest score
-            best_action = max(available_actions, key=lambda act: problem.get_action_score(act, state))
+            # Find the action with the highest score, argmax keeps the first of equally scored actions like max did
+            scores = problem.score_actions(available_actions, state)
+            best_action = available_actions[int(np.argmax(scores))]
 
             # Update the state with the best action
             state.update_state(best_action)
+            best_score = self.report_progress(problem, state, best_score)
 
         return state
@@ -0,0 +1,69 @@
+import heapq
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+import numpy as np
+
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .greedy_algorithm import GreedySolver
+from .solver import Solver
+
+
+class LazyGreedySolver(Solver):
+    def solve(self, problem: Problem, state: State) -> State:
+        """
+        Solve the problem like GreedySolver, without scoring every available action on every meal slot.
+        An action scores as its weight plus a term shared by all actions in the state, so the actions are kept in a
+        max-heap of their weights, and only the top of the heap is checked again on every slot. A greedy plan only
+        ever uses up products and moves forward in time, so an action that can no longer be made is dropped for good.
+        """
+        weights = problem.action_weights
+        if weights is None:
+            return GreedySolver().configure(self.deadline, self.on_improvement, self.cancellation).solve(problem, state)
+
+        # Actions of equal weight share one heap entry and are kept in increasing index order, like GreedySolver
+        # sees them
+        available = np.array([action.index for action in problem.get_available_actions(state)], dtype=np.int64)
+        distinct_weights, groups = np.unique(weights[available], return_inverse=True)
+        groups = groups.reshape(-1)
+        heap: List[Tuple[float, Deque[int]]] = []
+        for group, weight in enumerate(distinct_weights.tolist()):
+            heap.append((-weight, deque(available[groups == group].tolist())))
+        heapq.heapify(heap)
+
+        best_score = float('-inf')
+        while not problem.is_goal_state(state) and not self.should_stop():
+            best_index = self._best_action(problem, state, heap)
+            if best_index is None:
+                break  # No more actions available, terminate
+            state.update_state(problem.legal_actions[best_index])
+            best_score = self.report_progress(problem, state, best_score)
+        return state
+
+    @staticmethod
+    def _first_available(problem: Problem, state: State, indices: Deque[int]) -> Optional[int]:
+        """First action of a group that can be made, after dropping the ones before it"""
+        while indices and not problem.is_available_action(problem.legal_actions[indices[0]], state):
+            indices.popleft()
+        return indices[0] if indices else None
+
+    def _best_action(self, problem: Problem, state: State, heap: List[Tuple[float, Deque[int]]]) -> Optional[int]:
+        """Index of the action GreedySolver would choose, or None if no action can be made.
+        The action stays in the heap, since a recipe can be chosen again while its products last."""
+        while heap and self._first_available(problem, state, heap[0][1]) is None:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        # Weights that differ by less than the rounding of the shared term score the same, and of those actions
+        # GreedySolver takes the first one
+        state_score = problem.state_score(state)
+        best_score = -heap[0][0] + state_score
+        tied = []
+        while heap and -heap[0][0] + state_score == best_score:
+            entry = heapq.heappop(heap)
+            if self._first_available(problem, state, entry[1]) is not None:
+                tied.append(entry)
+        for entry in tied:
+            heapq.heappush(heap, entry)
+        return min(indices[0] for _, indices in tied)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from ..Problems.catalog import CACHE_DIR, _atomic_write
+from ..Problems.problem import Problem
+
+LEARNED_VALUES_VERSION = 1
+
+
+def _pantry_digest(problem: Problem) -> str:
+    """Hash of the products of the pantry of a problem, their quantities and their expiration days counted from the
+    start date"""
+    sha = hashlib.sha256("\n".join(problem.product_names).encode())
+    for array in (problem.pantry_quantities, problem.pantry_expiration_days):
+        sha.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+
+def learned_values_path(problem: Problem, solver_name: str, cache_dir=CACHE_DIR, by_pantry: bool = True) -> str:
+    """File of the values a solver learned for problems of the same type, recipes catalog, parameters and plan
+    length, and with `by_pantry` the same pantry. Values of states, like a Q-table, learned for another pantry or
+    plan length would estimate other plans, while weights of pantry independent features carry over to any pantry."""
+    key = [type(problem).__name__, problem.catalog.digest, list(getattr(problem, "parameters_to_maximize", [])),
+           problem.number_of_days, problem.meals_per_day]
+    if by_pantry:
+        key.append(_pantry_digest(problem))
+    key = json.dumps(key)
+    name = hashlib.sha256(key.encode()).hexdigest()[:32]
+    return os.path.join(cache_dir, "learned", f"{solver_name}-{name}.npz")
+
+
+def _save(path, arrays: Dict[str, np.ndarray]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = dict(arrays, version=np.array(LEARNED_VALUES_VERSION))
+    _atomic_write(path, lambda target: np.savez_compressed(target, **arrays))
+
+
+def _load(path) -> Optional[Dict[str, np.ndarray]]:
+    """The arrays of a file, or None if there is none or it cannot be read"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays["version"]) != LEARNED_VALUES_VERSION:
+                raise ValueError("saved by another version")
+            return {name: arrays[name] for name in arrays.files}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring learned values at {path}: {e}")
+        return None
+
+
+def save_q_table(path, problem: Problem, q_table: Dict[Tuple[Tuple[int, ...], int], float]) -> None:
+    """Save a Q-table keyed by sorted action indices and action index, as recipe IDs"""
+    keys = list({key for key, _ in q_table})
+    key_positions = {key: position for position, key in enumerate(keys)}
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(key) for key in keys], out=indptr[1:])
+    actions = [action for _, action in q_table]
+    recipe_ids = np.asarray([problem.legal_actions[index].action_id for index in range(len(problem.legal_actions))])
+    _save(path, {
+        "state_indptr": indptr,
+        "state_recipes": recipe_ids[np.array([index for key in keys for index in key], dtype=np.int64)],
+        "entry_states": np.array([key_positions[key] for key, _ in q_table], dtype=np.int64),
+        "entry_recipes": recipe_ids[np.array(actions, dtype=np.int64)],
+        "values": np.array(list(q_table.values()), dtype=np.float64),
+    })
+
+
+def load_q_table(path, problem: Problem) -> Optional[Dict[Tuple[Tuple[int, ...], int], float]]:
+    """Load a Q-table saved by save_q_table for the legal actions of the problem. Entries with recipes that are not
+    legal actions of the problem are dropped. None if nothing was saved."""
+    arrays = _load(path)
+    if arrays is None:
+        return None
+    index_of = {}
+    for action in problem.legal_actions:
+        index_of.setdefault(action.action_id, action.index)
+    state_recipes = [index_of.get(recipe_id) for recipe_id in arrays["state_recipes"].tolist()]
+    indptr = arrays["state_indptr"].tolist()
+    keys = []
+    for start, end in zip(indptr[:-1], indptr[1:]):
+        indices = state_recipes[start:end]
+        keys.append(None if None in indices else tuple(sorted(indices)))
+    q_table = {}
+    for state, recipe_id, value in zip(arrays["entry_states"].tolist(), arrays["entry_recipes"].tolist(),
+                                       arrays["values"].tolist()):
+        action = index_of.get(recipe_id)
+        if keys[state] is not None and action is not None:
+            q_table[(keys[state], action)] = value
+    return q_table
+
+
+def save_weights(path, weights: np.ndarray) -> None:
+    _save(path, {"weights": weights})
+
+
+def load_weights(path, features: int) -> Optional[np.ndarray]:
+    """Weights saved by save_weights, or None if nothing was saved for this number of features"""
+    arrays = _load(path)
+    if arrays is None or arrays["weights"].shape != (features,):
+        return None
+    return arrays["weights"]
@@ -0,0 +1,265 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ..Problems.batch_environment import BatchEnvironment
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .learned_values import learned_values_path, load_weights, save_weights
+from .solver import Solver, moving_average_converged, replay_plan, start_worker, worker_context
+
+# Features of an action on a day, see LinearRLSolver.day_features, then the ones that depend on the state: the
+# blocking of the action, see LinearRLSolver.blocking, and the share of the legal actions available in the state
+FEATURES = ("bias", "urgency", "expiring tomorrow", "parameters", "day", "weight", "size", "blocking", "available")
+
+# Transitions of a batch of episodes: the features of the actions made, their rewards, and the day of the state each
+# one led to with the actions available in it, one row each with their blocking as its data, empty where the
+# episode ended. Then the score of every episode, and the best plan, as action indices, and its score.
+Rollout = Tuple[np.ndarray, np.ndarray, np.ndarray, sparse.csr_matrix, np.ndarray, List[int], float]
+
+
+def _roll_out(solver: "LinearRLSolver", epsilon: float, seed: int, problem: Optional[Problem] = None,
+              initial_state: Optional[State] = None) -> Rollout:
+    """Run a batch of episodes with the weights of the solver. Runs in a worker process unless the problem and
+    initial state are given."""
+    if problem is None:
+        problem, initial_state = worker_context()
+    return solver.roll_out(problem, initial_state, epsilon, np.random.default_rng(seed))
+
+
+class LinearRLSolver(Solver):
+    def __init__(self, learning_rate=0.5, discount_factor=0.95, epsilon=0.3, epsilon_decay=0.99, episodes=200,
+                 batch_size=32, buffer_size=10000, environments=8, workers=1, convergence_window=50,
+                 convergence_threshold=0.001, seed=None, cache_dir=None, warm_episodes=50, regularization=1e-3):
+        # Every mini-batch moves the weights `learning_rate` of the way to the least squares fit of its targets,
+        # with a ridge penalty of `regularization` per transition
+        self.learning_rate = learning_rate
+        self.regularization = regularization
+        self.discount_factor = discount_factor
+        self.epsilon = epsilon
+        self.epsilon_decay = epsilon_decay
+        self.episodes = episodes
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        # Episodes run together in one BatchEnvironment, by each of the worker processes
+        self.environments = environments
+        self.workers = workers
+        # Training stops once the average score of the last window of episodes stops moving
+        self.convergence_window = convergence_window
+        self.convergence_threshold = convergence_threshold
+        self.seed = seed
+        # With a cache_dir, such as CACHE_DIR, the weights are saved there after every solve, and loaded by later
+        # solves of problems of the same type, recipes, parameters and plan length, whatever their pantry, which
+        # then only run warm_episodes episodes. None, the default, keeps them in memory only.
+        self.cache_dir = cache_dir
+        self.warm_episodes = warm_episodes
+        self.weights = np.zeros(len(FEATURES))
+        # Score of every episode of the last solve
+        self.episode_scores: List[float] = []
+        # Features of every legal action of the current problem, by day
+        self._day_features: Dict[int, np.ndarray] = {}
+        self._feature_problem: Optional[Problem] = None
+        self._feature_scale: Optional[np.ndarray] = None
+
+    def __getstate__(self):
+        # Workers build their own features instead of receiving them with every batch
+        state = self.__dict__.copy()
+        # Callbacks and cancellation tokens stay in the parent process, which checks them between batches
+        state.update(_day_features={}, _feature_problem=None, _feature_scale=None, on_improvement=None,
+                     cancellation=None)
+        return state
+
+    def solve(self, problem: Problem, initial_state: State) -> State:
+        """
+        Solve the given problem with Q-learning over a linear Q-function of per action features (see FEATURES), so
+        what is learned about one recipe carries over to the recipes that look like it.
+        Episodes run `environments` at a time in a BatchEnvironment, where all Q-values of a meal slot are one
+        matrix product and the epsilon-greedy choices and rewards of the batch are computed on arrays. With more
+        than one worker, every worker process runs its own batch with the same weights.
+        The weights are updated from random mini-batches of the transitions seen so far, one per `batch_size` new
+        transitions, see update_weights. Transitions keep the state they led to, so their targets use the current
+        weights. The reward of an action is the change of the score of the plan, so the Q-value of the first
+        action estimates the score of the whole plan.
+        Returns the best plan of all episodes. Training stops after the batch that runs past the deadline or into a
+        cancellation.
+        """
+        # The features are normalized and do not depend on the pantry, so the weights are shared by all pantries
+        path = None if self.cache_dir is None else \
+            learned_values_path(problem, type(self).__name__, self.cache_dir, by_pantry=False)
+        saved_weights = None if path is None else load_weights(path, len(FEATURES))
+        if saved_weights is not None:
+            self.weights = saved_weights.copy()
+        episodes = min(self.episodes, self.warm_episodes) if self.weights.any() else self.episodes
+        generator = np.random.default_rng(self.seed)
+        epsilon = self.epsilon
+        best_plan, best_score = [], float('-inf')
+        self.episode_scores = []
+        # Replay buffer of the features, reward, next day and next available actions of every transition
+        buffer_features = np.zeros((self.buffer_size, len(FEATURES)))
+        buffer_rewards = np.zeros(self.buffer_size)
+        buffer_days = np.zeros(self.buffer_size, dtype=np.int64)
+        buffer_actions: List[np.ndarray] = [np.zeros(0, dtype=np.int64)] * self.buffer_size
+        buffer_blocking: List[np.ndarray] = [np.zeros(0)] * self.buffer_size
+        stored = 0
+
+        workers = max(self.workers or os.cpu_count() or 1, 1)
+        executor = ProcessPoolExecutor(workers, initializer=start_worker, initargs=(problem, initial_state)) \
+            if workers > 1 else None
+        try:
+            while len(self.episode_scores) < episodes and not (self.episode_scores and self.should_stop()):
+                seeds = generator.integers(2 ** 32, size=workers).tolist()
+                if executor is None:
+                    rollouts = [_roll_out(self, epsilon, seeds[0], problem, initial_state)]
+                else:
+                    futures = [executor.submit(_roll_out, self, epsilon, seed) for seed in seeds]
+                    rollouts = [future.result() for future in futures]
+
+                for features, rewards, next_days, next_actions, scores, plan, score in rollouts:
+                    positions = (stored + np.arange(len(rewards))) % self.buffer_size
+                    buffer_features[positions], buffer_rewards[positions], buffer_days[positions] = \
+                        features, rewards, next_days
+                    for row, position in enumerate(positions.tolist()):
+                        entries = slice(next_actions.indptr[row], next_actions.indptr[row + 1])
+                        buffer_actions[position] = next_actions.indices[entries]
+                        buffer_blocking[position] = next_actions.data[entries]
+                    stored += len(rewards)
+                    available = min(stored, self.buffer_size)
+                    if available >= self.batch_size:
+                        for _ in range(len(rewards) // self.batch_size):
+                            batch = generator.integers(available, size=self.batch_size)
+                            self.update_weights(problem, buffer_features[batch], buffer_rewards[batch],
+                                                buffer_days[batch], [buffer_actions[position] for position in batch],
+                                                [buffer_blocking[position] for position in batch])
+                    self.episode_scores.extend(scores.tolist())
+                    if score > best_score:
+                        best_plan, best_score = plan, score
+                        if self.on_improvement is not None:
+                            self.report_improvement(replay_plan(problem, initial_state, best_plan), best_score)
+                    epsilon *= self.epsilon_decay ** len(scores)
+                if moving_average_converged(self.episode_scores, self.convergence_window,
+                                            self.convergence_threshold):
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if path is not None:
+            save_weights(path, self.weights)
+        return replay_plan(problem, initial_state, best_plan)
+
+    def roll_out(self, problem: Problem, initial_state: State, epsilon: float,
+                 generator: np.random.Generator) -> Rollout:
+        """Run a batch of `environments` episodes with the current weights, choosing epsilon-greedily"""
+        environment = BatchEnvironment(problem, initial_state, self.environments)
+        features, rewards, next_days, next_actions = [], [], [], []
+        # Environments that made an action on the last slot, whose transitions wait for their next state
+        pending = None
+        while True:
+            feasible = environment.feasible()
+            day_features = self.day_features(problem, environment.day)
+            blocking = self.blocking(problem, environment.quantities, feasible)
+            available = feasible.sum(axis=1, keepdims=True) / max(len(problem.legal_actions), 1)
+            q_values = np.where(feasible, day_features @ self.weights + blocking * self.weights[-2] +
+                                available * self.weights[-1], -np.inf)
+            can_act = feasible.any(axis=1)
+            if pending is not None:
+                next_days.append(np.full(len(pending), environment.day, dtype=np.int64))
+                # Built from its parts, so the actions that block nothing keep their entry
+                rows, columns = np.nonzero(feasible[pending])
+                indptr = np.zeros(len(pending) + 1, dtype=np.int64)
+                np.cumsum(np.bincount(rows, minlength=len(pending)), out=indptr[1:])
+                next_actions.append(sparse.csr_matrix((blocking[pending][rows, columns], columns, indptr),
+                                                      shape=feasible[pending].shape))
+            if not can_act.any():
+                break
+
+            # Random feasible actions for exploring environments, the best ones for the others
+            explore = generator.random(len(feasible)) < epsilon
+            random_actions = np.argmax(np.where(feasible, generator.random(feasible.shape), -1.0), axis=1)
+            actions = np.where(explore, random_actions, np.argmax(q_values, axis=1))
+            actions[~can_act] = -1
+            step_rewards = environment.step(actions)
+            pending = np.flatnonzero(can_act)
+            action_features = day_features[actions[pending]].copy()
+            action_features[:, -2] = blocking[pending, actions[pending]]
+            action_features[:, -1] = available[pending, 0]
+            features.append(action_features)
+            rewards.append(step_rewards[pending])
+
+        best = int(np.argmax(environment.scores))
+        return (np.concatenate(features) if features else np.zeros((0, len(FEATURES))),
+                np.concatenate(rewards) if rewards else np.zeros(0),
+                np.concatenate(next_days) if next_days else np.zeros(0, dtype=np.int64),
+                sparse.vstack(next_actions, format="csr") if next_actions else
+                sparse.csr_matrix((0, len(problem.legal_actions))),
+                environment.scores, environment.plan(best), float(environment.scores[best]))
+
+    def update_weights(self, problem: Problem, features: np.ndarray, rewards: np.ndarray, next_days: np.ndarray,
+                       next_actions: List[np.ndarray], next_blocking: List[np.ndarray]) -> None:
+        """
+        Move the weights `learning_rate` of the way to the ridge regression of the TD targets of a mini-batch of
+        transitions, given by the features of their actions, their rewards, and the day of the state they led to
+        with the actions available in it and their blocking. The best Q-value of that state is computed with the
+        current weights, 0 if no action is available in it.
+        Fitting the mini-batch, instead of a gradient step, brings the weights to the scale of the plan scores within
+        a few batches, and the features that only depend on the state absorb its value, so the others rank actions.
+        """
+        next_q = np.zeros(len(rewards))
+        for day in np.unique(next_days).tolist():
+            q_values = self.day_features(problem, day) @ self.weights
+            for position in np.flatnonzero(next_days == day).tolist():
+                actions = next_actions[position]
+                if len(actions):
+                    next_q[position] = np.max(q_values[actions] + next_blocking[position] * self.weights[-2]) + \
+                        len(actions) / len(problem.legal_actions) * self.weights[-1]
+        targets = rewards + self.discount_factor * next_q
+        gram = features.T @ features + self.regularization * len(rewards) * np.eye(len(FEATURES))
+        fitted = np.linalg.solve(gram, features.T @ targets)
+        self.weights += self.learning_rate * (fitted - self.weights)
+
+    def day_features(self, problem: Problem, day: int) -> np.ndarray:
+        """
+        Features of every legal action on the given day, one row per action:
+        urgency: sum over its products of 1 / (days until the product expires + 1)
+        expiring tomorrow: how many of its products can only be used today or tomorrow
+        parameters: the normalized parameters of ParametersProblem, 0 for the other problems
+        day: the day, as a share of the plan
+        weight: the action weight of the problem, 0 if it has none
+        size: the number of products it uses
+        Columns are scaled by their largest value on the first day, so one regularization suits all of them. The
+        columns that depend on the state are 0 here.
+        """
+        if problem is not self._feature_problem:
+            self._feature_problem, self._day_features, self._feature_scale = problem, {}, None
+        features = self._day_features.get(day)
+        if features is None:
+            days_left = problem.product_expiration_days.astype(np.float64) - day
+            with np.errstate(divide="ignore"):
+                urgency = problem.incidence @ np.where(days_left > 0, 1 / (days_left + 1), 0.0)
+            expiring = problem.incidence @ ((days_left > 0) & (days_left <= 2)).astype(np.float64)
+            actions = len(problem.legal_actions)
+            parameters = getattr(problem, "parameter_scores", np.zeros(actions))
+            weights = problem.action_weights if problem.action_weights is not None else np.zeros(actions)
+            features = np.column_stack([np.ones(actions), urgency, expiring, parameters,
+                                        np.full(actions, day / problem.number_of_days), weights,
+                                        problem.action_sizes, np.zeros(actions), np.zeros(actions)])
+            if self._feature_scale is None:
+                scale = np.abs(features).max(axis=0) if actions else np.ones(len(FEATURES))
+                self._feature_scale = np.where(scale > 0, scale, 1.0)
+            features = features / self._feature_scale
+            self._day_features[day] = features
+        return features
+
+    @staticmethod
+    def blocking(problem: Problem, quantities: np.ndarray, feasible: np.ndarray) -> np.ndarray:
+        """Share of the other feasible actions of every plan that need the last piece of a product an action uses,
+        one row per plan of a BatchEnvironment and one column per action. An action that blocks many others
+        shortens the plan."""
+        # Feasible actions that use each product, counted only for the products of which one piece is left
+        demand = (problem.incidence.T @ feasible.T.astype(np.float64)).T
+        contested = np.where(quantities == 1, np.maximum(demand - 1, 0), 0.0)
+        blocked = (problem.incidence @ contested.T).T
+        return blocked / np.maximum(feasible.sum(axis=1, keepdims=True), 1)
@@ -0,0 +1,247 @@
+import itertools
+import math
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..Problems.batch_environment import BatchEnvironment
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .lazy_greedy_algorithm import LazyGreedySolver
+from .solver import Solver, replay_plan, start_worker, worker_context
+
+# Default policies of the rollouts, see MCTSSolver.roll_out
+ROLLOUT_POLICIES = ("random", "greedy")
+
+
+def _search(plan: List[int], slot_deadline: Optional[float], deadline: Optional[float],
+            tree: Optional["_SearchTree"] = None):
+    """Move the root of the tree to the end of the plan, given by action indices, and search from it until the
+    rollout budget or the deadline of the slot, see _SearchTree.search. Returns the visits of every action of the
+    root, and the best plan the tree has seen and its score. Uses the tree of the worker process, kept between the
+    meal slots so its subtree is reused, unless a tree is given."""
+    if tree is None:
+        tree, = worker_context()
+    tree.advance(plan)
+    visits = tree.search(slot_deadline, deadline)
+    return visits, tree.best_plan, tree.best_score
+
+
+class _Node:
+    """A state of the search tree, with the children of the actions expanded from it"""
+    __slots__ = ("state", "children", "untried", "visits", "total")
+
+    def __init__(self, state: State):
+        self.state = state
+        self.children: Dict[int, "_Node"] = {}
+        # Indices of the actions not expanded yet, the best scored last, listed when the node is first selected
+        self.untried: Optional[List[int]] = None
+        self.visits = 0
+        self.total = 0.0
+
+
+class _SearchTree:
+    def __init__(self, solver: "MCTSSolver", problem: Problem, initial_state: State, seed: int):
+        self.solver = solver
+        self.problem = problem
+        self.initial_length = len(initial_state.selected_actions)
+        self.root = _Node(initial_state.__copy__())
+        self.generator = np.random.default_rng(seed)
+        # Best complete plan of all rollouts, as the indices of the actions added to the initial state
+        self.best_plan: List[int] = []
+        self.best_score = float('-inf')
+        # Range of the rollout scores, which scales the mean scores of the nodes to [0, 1] for UCT
+        self.lowest, self.highest = float('inf'), float('-inf')
+
+    def advance(self, plan: List[int]) -> None:
+        """Move the root down the actions of the plan it has not made yet, keeping the subtree below it"""
+        for index in plan[len(self.root.state.selected_actions) - self.initial_length:]:
+            child = self.root.children.get(index)
+            if child is None:
+                state = self.root.state.__copy__()
+                state.update_state(self.problem.legal_actions[index])
+                child = _Node(state)
+            self.root = child
+
+    def search(self, slot_deadline: Optional[float], deadline: Optional[float]) -> Dict[int, int]:
+        """Run rollouts from the root until the rollout budget or the deadline of the slot. A slot whose time ran
+        out still gets one rollout, so the root has an action to choose, unless the deadline of the whole solve
+        passed too, and rollouts stop at that deadline. Returns the visits of every action of the root."""
+        rollouts = max(self.solver.rollouts, 1) if self.solver.rollouts is not None else None
+        for iteration in range(rollouts) if rollouts is not None else itertools.count():
+            if self.solver.should_stop() or (deadline is not None and time.time() >= deadline) or \
+                    (iteration and slot_deadline is not None and time.time() >= slot_deadline):
+                break
+            self._iterate(deadline)
+        return {index: child.visits for index, child in self.root.children.items()}
+
+    def _iterate(self, deadline: Optional[float]) -> None:
+        """Select a path by UCT, expand its leaf by one action, roll out from it and back up the score"""
+        node, path = self.root, [self.root]
+        untried = self._untried(node)
+        while not untried and node.children:
+            node = self._select(node)
+            path.append(node)
+            untried = self._untried(node)
+        if untried:
+            index = untried.pop()
+            state = node.state.__copy__()
+            state.update_state(self.problem.legal_actions[index])
+            child = _Node(state)
+            node.children[index] = child
+            node = child
+            path.append(node)
+
+        score, added = self.solver.roll_out(self.problem, node.state, self.generator, deadline)
+        if score > self.best_score:
+            self.best_score = score
+            self.best_plan = [action.index for action in node.state.selected_actions[self.initial_length:]] + added
+        self.lowest, self.highest = min(self.lowest, score), max(self.highest, score)
+        for visited in path:
+            visited.visits += 1
+            visited.total += score
+
+    def _untried(self, node: _Node) -> List[int]:
+        """Actions of the node not expanded yet, its best `max_children` actions by the score they add"""
+        if node.untried is None:
+            problem = self.problem
+            available_actions = [] if problem.is_goal_state(node.state) else \
+                problem.get_available_actions(node.state)
+            if available_actions:
+                scores = problem.score_actions(available_actions, node.state)
+                best = np.argsort(-scores, kind="stable")[:self.solver.max_children].tolist()
+                node.untried = [available_actions[position].index for position in reversed(best)]
+            else:
+                node.untried = []
+        return node.untried
+
+    def _select(self, node: _Node) -> _Node:
+        """Child with the highest upper confidence bound of its scaled mean score"""
+        scale = self.highest - self.lowest or 1.0
+        exploration = self.solver.exploration * math.sqrt(math.log(node.visits))
+        return max(node.children.values(),
+                   key=lambda child: (child.total / child.visits - self.lowest) / scale +
+                   exploration / math.sqrt(child.visits))
+
+
+class MCTSSolver(Solver):
+    def __init__(self, rollouts: Optional[int] = 100, time_limit: Optional[float] = None, exploration: float = 0.5,
+                 max_children: Optional[int] = 16, rollout_policy: str = "random", rollout_batch: int = 16,
+                 workers: Optional[int] = 1, seed: Optional[int] = None):
+        if rollout_policy not in ROLLOUT_POLICIES:
+            raise ValueError(f"Unknown rollout policy {rollout_policy}, expected one of {ROLLOUT_POLICIES}.")
+        # Every meal slot gets `rollouts` rollouts, or its share of the time limit in seconds, whichever ends first
+        self.rollouts = rollouts
+        self.time_limit = time_limit
+        # Weight of the exploration term of UCT, for mean scores scaled to [0, 1]
+        self.exploration = exploration
+        # Only the best actions of a state by the score they add are expanded, None expands all of them
+        self.max_children = max_children
+        self.rollout_policy = rollout_policy
+        self.rollout_batch = rollout_batch
+        # Every worker process searches its own tree, and their visits are added up
+        self.workers = workers
+        self.seed = seed
+
+    def __getstate__(self):
+        # Callbacks and cancellation tokens stay in the parent process, which checks them between meal slots
+        state = self.__dict__.copy()
+        state.update(on_improvement=None, cancellation=None)
+        return state
+
+    def solve(self, problem: Problem, initial_state: State) -> State:
+        """
+        Solve the given problem with Monte Carlo Tree Search over the meal slots. For every slot, rollouts from the
+        current state select a path down the tree by UCT, expand one more action and complete the plan with the
+        default policy (see roll_out), and the action of the slot is the most visited one. The subtree below it is
+        kept for the next slot.
+        With more than one worker, every worker process searches its own tree from the same state with its own
+        seed, so the solve runs `workers` times the rollouts, and the action is the most visited one over all trees.
+        Once the deadline passes, the search stops and the plan is completed by LazyGreedySolver, and the better
+        of that plan and the best plan of all rollouts is returned.
+        """
+        if self.rollouts is None and self.time_limit is None and self.deadline is None and \
+                self.cancellation is None:
+            raise ValueError("Tree search needs a number of rollouts, a time limit, a deadline or a cancellation "
+                             "token.")
+        deadline = self.earliest_deadline(None if self.time_limit is None else time.time() + self.time_limit)
+        generator = np.random.default_rng(self.seed)
+        workers = max(self.workers or os.cpu_count() or 1, 1)
+        seeds = generator.integers(2 ** 32, size=workers).tolist()
+        # One executor per tree, so every tree stays in the same process
+        executors = [ProcessPoolExecutor(1, initializer=start_worker,
+                                         initargs=(_SearchTree(self, problem, initial_state, seed),))
+                     for seed in seeds] if workers > 1 else []
+        # Workers start, and receive the problem, before the time of the first meal slot is measured
+        for future in [executor.submit(len, []) for executor in executors]:
+            future.result()
+        tree = None if executors else _SearchTree(self, problem, initial_state, seeds[0])
+
+        state = initial_state.__copy__()
+        plan: List[int] = []
+        best_plan, best_score = [], problem.get_score(initial_state)
+        slots = problem.number_of_days * problem.meals_per_day
+        try:
+            while not problem.is_goal_state(state) and not self.should_stop() and \
+                    (deadline is None or time.time() < deadline):
+                slot_deadline = None if deadline is None else \
+                    time.time() + (deadline - time.time()) / max(slots - len(state.selected_actions), 1)
+                if tree is not None:
+                    results = [_search(plan, slot_deadline, deadline, tree)]
+                else:
+                    futures = [executor.submit(_search, plan, slot_deadline, deadline) for executor in executors]
+                    results = [future.result() for future in futures]
+
+                visits = Counter()
+                improved = False
+                for root_visits, tree_plan, tree_score in results:
+                    visits.update(root_visits)
+                    if tree_score > best_score:
+                        best_plan, best_score, improved = tree_plan, tree_score, True
+                if improved and self.on_improvement is not None:
+                    self.report_improvement(replay_plan(problem, initial_state, best_plan), best_score)
+                if not visits:
+                    break  # No more actions available, or out of time, terminate
+                # The most visited action, the first of equally visited ones
+                index = max(sorted(visits), key=lambda action_index: visits[action_index])
+                plan.append(index)
+                state.update_state(problem.legal_actions[index])
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+        # A search cut short by time or cancellation leaves the rest of the plan to the cheap greedy completion
+        state = LazyGreedySolver().solve(problem, state)
+        if problem.get_score(state) < best_score:
+            state = replay_plan(problem, initial_state, best_plan)
+        return state
+
+    def roll_out(self, problem: Problem, state: State, generator: np.random.Generator,
+                 deadline: Optional[float] = None) -> Tuple[float, List[int]]:
+        """
+        Complete the plan of the state with the default policy. Returns the score of the completed plan and the
+        indices of the actions it added. At the deadline, the plan is left as far as it got.
+        random: `rollout_batch` plans of random available actions, made together in a BatchEnvironment, of which
+        the best one counts
+        greedy: the plan of LazyGreedySolver, also used for problems whose score does not split into action weights
+        """
+        if self.rollout_policy == "greedy" or problem.action_weights is None:
+            completed = LazyGreedySolver().configure(deadline).solve(problem, state.__copy__())
+            return problem.get_score(completed), \
+                [action.index for action in completed.selected_actions[len(state.selected_actions):]]
+
+        environment = BatchEnvironment(problem, state, self.rollout_batch)
+        while deadline is None or time.time() < deadline:
+            feasible = environment.feasible()
+            can_act = feasible.any(axis=1)
+            if not can_act.any():
+                break
+            actions = np.argmax(np.where(feasible, generator.random(feasible.shape), -1.0), axis=1)
+            actions[~can_act] = -1
+            environment.step(actions)
+        best = int(np.argmax(environment.scores))
+        return float(environment.scores[best]), environment.plan(best)
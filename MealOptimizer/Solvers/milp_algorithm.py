@@ -0,0 +1,169 @@
+import time
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .lazy_greedy_algorithm import LazyGreedySolver
+from .solver import Solver, best_sums
+
+
+class MILPSolver(Solver):
+    def __init__(self, time_limit: Optional[float] = 60.0):
+        self.time_limit = time_limit
+        # Outcome of the last solve: the score of the plan found and whether every integer program was solved to
+        # optimality
+        self.best_score = None
+        self.proven_optimal = False
+        self._deadline = None
+
+    def solve(self, problem: Problem, state: State) -> State:
+        """
+        Solve the given problem as a mixed integer program with the HiGHS solver bundled with SciPy.
+        The score of a plan does not depend on the order of its meals, and a plan that can be made in some order
+        can be made in order of expiration, so instead of a binary per recipe and slot the program chooses how many
+        times to make every recipe: at most one recipe per slot becomes at most D recipes that expire within the
+        first D slots, for every expiration. Products used up may not exceed the stock.
+        The state term 1 / (expiring + 1) is linearized with a binary per product that is still in stock at the end,
+        and a one-hot choice of the number of expiring products, once for every length of plan worth trying.
+        The plan found is made in order of expiration on a copy of the state. The greedy plan is the first
+        incumbent, so a solve that runs out of time never returns a worse plan.
+        """
+        if problem.action_weights is None:
+            raise ValueError(f"{type(problem).__name__} does not split its score into action weights.")
+        available_actions = [] if problem.is_goal_state(state) else problem.get_available_actions(state)
+        indices = np.array([action.index for action in available_actions], dtype=np.int64)
+        repeat_limits = problem.repeat_limits(state, indices) if len(indices) else np.zeros(0, dtype=np.int64)
+        indices, repeat_limits = indices[repeat_limits > 0], repeat_limits[repeat_limits > 0]
+
+        self.proven_optimal = True
+        self._deadline = self.earliest_deadline(None if self.time_limit is None else time.time() + self.time_limit)
+        best_state = LazyGreedySolver().solve(problem, state.__copy__())
+        best_score = problem.get_score(best_state)
+        self.report_improvement(best_state, best_score)
+        selected = len(state.selected_actions)
+        weights = problem.action_weights[indices]
+        remaining = problem.number_of_days * problem.meals_per_day - selected
+        best_weights = best_sums(weights, repeat_limits, remaining)
+        longest = self._longest_plan(problem, state, indices, repeat_limits, len(best_weights))
+        # Longer plans first, since they usually score higher and let the shorter ones be skipped
+        for added in range(longest, 0, -1):
+            if self.should_stop() or (self._deadline is not None and time.time() >= self._deadline):
+                # Out of time or cancelled between programs, HiGHS itself only stops at the deadline
+                self.proven_optimal = False
+                break
+            length = selected + added
+            # Score if the best recipes could all be made and nothing expired, fewer expiring pieces never score less
+            if problem.selected_weight(state) + best_weights[added - 1] + \
+                    length * problem.expiring_score(0) <= best_score:
+                continue
+            program = self._length_program(problem, state, indices, repeat_limits, added)
+            # The linear relaxation of the program is much faster to solve, and bounds its score
+            relaxation = self._solve(program, relaxed=True)
+            if relaxation is None or problem.selected_weight(state) - relaxation.fun + 1e-6 <= best_score:
+                continue
+            result = self._solve(program, relaxed=False)
+            if result is None:
+                continue
+            counts = np.round(result.x[:len(indices)]).astype(np.int64)
+            plan = state.__copy__()
+            for position in np.lexsort((indices, problem.action_expiration_days[indices])).tolist():
+                for _ in range(counts[position]):
+                    plan.update_state(problem.legal_actions[indices[position]])
+            score = problem.get_score(plan)
+            if not problem.is_goal_state(plan) and problem.get_available_actions(plan):
+                # Like the other solvers, plans only end early when no more actions can be made. A shorter plan
+                # could still have been made without this one, so it can no longer be proven optimal.
+                if score > best_score:
+                    self.proven_optimal = False
+                continue
+            if score > best_score:
+                best_state, best_score = plan, score
+                self.report_improvement(best_state, best_score)
+        self.best_score = best_score
+        return best_state
+
+    def _solve(self, program: tuple, relaxed: bool):
+        """Solve an integer program, or its linear relaxation, within the time left. Returns None if it has no
+        solution or none was found in time"""
+        objective, constraints, bounds = program
+        options = {}
+        if self._deadline is not None:
+            options["time_limit"] = max(self._deadline - time.time(), 0.0)
+        integrality = np.zeros(len(objective)) if relaxed else np.ones(len(objective))
+        result = milp(objective, integrality=integrality, bounds=bounds, constraints=constraints, options=options)
+        if result.status != 0:
+            # Out of time, possibly with a feasible solution, or no solution at all
+            self.proven_optimal = False if result.status == 1 else self.proven_optimal
+            if result.x is None:
+                return None
+        return result
+
+    def _longest_plan(self, problem: Problem, state: State, indices: np.ndarray, repeat_limits: np.ndarray,
+                      most: int) -> int:
+        """Most actions that can still be added to the state, at most `most`"""
+        if not len(indices):
+            return 0
+        program = self._length_program(problem, state, indices, repeat_limits, most, exact=False)
+        objective = -np.concatenate([np.ones(len(indices)), np.zeros(len(program[0]) - len(indices))])
+        result = self._solve((objective,) + program[1:], relaxed=False)
+        return 0 if result is None else int(round(-result.fun))
+
+    @staticmethod
+    def _length_program(problem: Problem, state: State, indices: np.ndarray, repeat_limits: np.ndarray, added: int,
+                        exact: bool = True) -> tuple:
+        """Objective, constraints and bounds of the program that finds the best plan adding exactly `added` actions,
+        or at most `added` actions without the state term if not `exact`"""
+        selected = len(state.selected_actions)
+        length = selected + added
+        quantities = problem.state_quantities(state)
+        uses = problem.incidence[indices]
+        used_products = np.unique(uses.indices)
+        product_uses = uses[:, used_products].T.tocsr()
+
+        # Products in stock at the end of the plan count as expiring if they expire before the day after it. Those
+        # no action uses stay in stock, the others are in stock unless they are used up.
+        expiring = (quantities > 0) & (problem.pantry_expiration_days < 1 + length // problem.meals_per_day)
+        usable = np.zeros(len(quantities), dtype=bool)
+        usable[used_products] = True
+        stuck = int(np.count_nonzero(expiring & ~usable))
+        at_risk = np.flatnonzero(expiring[used_products])
+        expiring_scores = length * problem.expiring_score(stuck + np.arange(len(at_risk) + 1))
+        if not exact or not np.any(expiring_scores != expiring_scores[0]):
+            at_risk = at_risk[:0]
+            expiring_scores = expiring_scores[:1]
+
+        # Variables: times every action is made, whether every product at risk is left in stock, and the one-hot
+        # number of those products
+        actions, risks, counts = len(indices), len(at_risk), len(expiring_scores)
+        objective = -np.concatenate([problem.action_weights[indices], np.zeros(risks), expiring_scores])
+        deadlines = np.minimum(problem.slots_before_expiration(indices) - selected, added)
+        distinct_deadlines = np.unique(deadlines)
+        constraints = [
+            # Exactly `added` actions, and at most D of them expire within the first D slots
+            LinearConstraint(sparse.hstack([sparse.csr_matrix(np.ones((1, actions))),
+                                            sparse.csr_matrix((1, risks + counts))]), added if exact else 0, added),
+            LinearConstraint(sparse.hstack([sparse.csr_matrix(deadlines[None, :] <= distinct_deadlines[:, None],
+                                                              dtype=np.float64),
+                                            sparse.csr_matrix((len(distinct_deadlines), risks + counts))]),
+                             -np.inf, distinct_deadlines),
+            # Products used up may not exceed the stock
+            LinearConstraint(sparse.hstack([product_uses, sparse.csr_matrix((len(used_products), risks + counts))]),
+                             -np.inf, quantities[used_products]),
+            # A product at risk is left in stock unless its whole stock is used up
+            LinearConstraint(sparse.hstack([product_uses[at_risk],
+                                            sparse.diags(quantities[used_products][at_risk].astype(np.float64)),
+                                            sparse.csr_matrix((risks, counts))]),
+                             quantities[used_products][at_risk], np.inf),
+            # One number of products at risk left in stock, and it is the number of them left in stock
+            LinearConstraint(sparse.hstack([sparse.csr_matrix((1, actions + risks)),
+                                            sparse.csr_matrix(np.ones((1, counts)))]), 1, 1),
+            LinearConstraint(sparse.hstack([sparse.csr_matrix((1, actions)), sparse.csr_matrix(np.ones((1, risks))),
+                                            sparse.csr_matrix(-np.arange(counts, dtype=np.float64)[None, :])]), 0, 0),
+        ]
+        bounds = Bounds(np.zeros(actions + risks + counts),
+                        np.concatenate([repeat_limits, np.ones(risks + counts)]).astype(np.float64))
+        return objective, constraints, bounds
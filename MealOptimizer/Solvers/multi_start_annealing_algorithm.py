@@ -0,0 +1,136 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from ..Problems.problem import Problem
+from ..Problems.state import State
+from .simulated_annealing_algorithm import SimulatedAnnealingSolver
+from .solver import Solver, replay_plan, start_worker, worker_context
+
+# A chain between rounds: the indices of its current plan, its temperature and the state of its generator
+Chain = Tuple[List[int], float, tuple]
+
+# Iterations of a round when the chains do not exchange plans but the solve reports improvements or can be cancelled,
+# which the chains in worker processes cannot do themselves
+PROGRESS_INTERVAL = 1000
+
+
+def _run_round(solver: SimulatedAnnealingSolver, chain: Chain, iterations: Optional[int], deadline: Optional[float],
+               reheat_temperature: float, problem: Optional[Problem] = None, initial_state: Optional[State] = None):
+    """Continue a chain for a number of iterations or until the deadline. Returns the chain, its current score and
+    its best plan and score. Runs in a worker process unless the problem and initial state are given."""
+    if problem is None:
+        problem, initial_state = worker_context()
+    plan, temperature, random_state = chain
+    solver.random.setstate(random_state)
+    current_state, current_score, best_state, best_score, temperature = solver.anneal(
+        problem, replay_plan(problem, initial_state, plan), temperature, iterations, deadline, reheat_temperature)
+    current_plan = [action.index for action in current_state.selected_actions]
+    best_plan = [action.index for action in best_state.selected_actions]
+    return (current_plan, temperature, solver.random.getstate()), current_score, best_plan, best_score
+
+
+class MultiStartAnnealingSolver(Solver):
+    def __init__(self, chains: Optional[int] = None, workers: Optional[int] = None,
+                 exchange_interval: Optional[int] = None, seed: Optional[int] = None,
+                 initial_temperature: Optional[float] = None, cooling_rate: float = 0.995,
+                 iterations: Optional[int] = 1000, time_limit: Optional[float] = None):
+        self.chains = chains or os.cpu_count() or 1
+        self.workers = workers
+        self.exchange_interval = exchange_interval
+        self.seed = seed
+        self.initial_temperature = initial_temperature
+        self.cooling_rate = cooling_rate
+        self.iterations = iterations
+        self.time_limit = time_limit
+
+    def solve(self, problem: Problem, initial_state: State) -> State:
+        """
+        Solve the given problem with several independently seeded SimulatedAnnealingSolver chains, one per process,
+        and return the best plan of all of them. Every chain runs `iterations` iterations, or until the time limit,
+        so it takes about as long as a single chain when there are enough cores.
+        The problem is sent to every worker once, and plans are sent between processes as action indices.
+        If `exchange_interval` is set, the chains run at a ladder of temperatures, halving from the hottest, and
+        after every `exchange_interval` iterations neighbouring chains swap their plans as in parallel tempering,
+        so good plans move down to the colder chains.
+        Better plans are reported and cancellation is checked between rounds.
+        """
+        if self.iterations is None and self.time_limit is None and self.deadline is None and \
+                self.cancellation is None:
+            raise ValueError("Simulated annealing needs a number of iterations, a time limit, a deadline or a "
+                             "cancellation token.")
+        deadline = self.earliest_deadline(None if self.time_limit is None else time.time() + self.time_limit)
+        generator = random.Random(self.seed)
+        seeds = generator.sample(range(2 ** 32), self.chains)
+        solvers = [SimulatedAnnealingSolver(self.initial_temperature, self.cooling_rate, self.iterations, seed)
+                   for seed in seeds]
+        temperature = self.initial_temperature
+        if temperature is None:
+            temperature = SimulatedAnnealingSolver(seed=generator.random()).calibrate_temperature(problem,
+                                                                                                  initial_state)
+        ladder = self.exchange_interval is not None
+        temperatures = [temperature / 2 ** position if ladder else temperature for position in range(self.chains)]
+        chains: List[Chain] = [([action.index for action in initial_state.selected_actions], chain_temperature,
+                                solver.random.getstate())
+                               for chain_temperature, solver in zip(temperatures, solvers)]
+        interval = self.exchange_interval
+        if interval is None:
+            anytime = self.on_improvement is not None or self.cancellation is not None
+            interval = PROGRESS_INTERVAL if anytime else self.iterations
+        best_plan, best_score = chains[0][0], problem.get_score(initial_state)
+
+        workers = min(self.workers or os.cpu_count() or 1, self.chains)
+        executor = ProcessPoolExecutor(workers, initializer=start_worker, initargs=(problem, initial_state)) \
+            if workers > 1 else None
+        if executor is None:
+            # Chains in this process can also stop in the middle of a round
+            for solver in solvers:
+                solver.cancellation = self.cancellation
+        try:
+            done = 0
+            while (self.iterations is None or done < self.iterations) and \
+                    (deadline is None or time.time() < deadline) and not self.should_stop():
+                iterations = interval if self.iterations is None else min(interval, self.iterations - done)
+                results = self._run_chains(executor, problem, initial_state, solvers, chains, temperatures,
+                                           iterations, deadline)
+                done += iterations or 0
+                chains = [result[0] for result in results]
+                improved = False
+                for _, _, plan, score in results:
+                    if score > best_score:
+                        best_plan, best_score, improved = plan, score, True
+                if improved and self.on_improvement is not None:
+                    self.report_improvement(replay_plan(problem, initial_state, best_plan), best_score)
+                if ladder:
+                    self._exchange(chains, [result[1] for result in results], generator)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return replay_plan(problem, initial_state, best_plan)
+
+    @staticmethod
+    def _run_chains(executor: Optional[Executor], problem: Problem, initial_state: State,
+                    solvers: List[SimulatedAnnealingSolver], chains: List[Chain], temperatures: List[float],
+                    iterations: Optional[int], deadline: Optional[float]) -> list:
+        """Run a round of every chain, see _run_round, in the worker processes of the executor if there is one"""
+        if executor is None:
+            return [_run_round(solver, chain, iterations, deadline, temperature, problem, initial_state)
+                    for solver, chain, temperature in zip(solvers, chains, temperatures)]
+        futures = [executor.submit(_run_round, solver, chain, iterations, deadline, temperature)
+                   for solver, chain, temperature in zip(solvers, chains, temperatures)]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _exchange(chains: List[Chain], scores: List[float], generator: random.Random) -> None:
+        """Swap the plans of neighbouring chains with the parallel tempering acceptance probability"""
+        for position in range(len(chains) - 1):
+            (hot_plan, hot_temperature, hot_random), (cold_plan, cold_temperature, cold_random) = \
+                chains[position], chains[position + 1]
+            exponent = (scores[position] - scores[position + 1]) * (1 / cold_temperature - 1 / hot_temperature)
+            if exponent >= 0 or math.exp(exponent) > generator.random():
+                chains[position] = (cold_plan, hot_temperature, hot_random)
+                chains[position + 1] = (hot_plan, cold_temperature, cold_random)
+                scores[position], scores[position + 1] = scores[position + 1], scores[position]
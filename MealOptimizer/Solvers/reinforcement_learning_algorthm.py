@@ -1,65 +1,128 @@
+import bisect
 import random
 from typing import Dict, Tuple, List
 from ..Problems.problem import Problem
 from ..Problems.state import State
 from ..Problems.utils import Action, Piece
-from .solver import Solver
+from .learned_values import learned_values_path, load_q_table, save_q_table
+from .solver import Solver, moving_average_converged
+
+# The indices of the selected actions of a state in increasing order. A plan uses up the same products whatever
+# the order of its actions, and its length gives the meal slot, so states with the same key are the same state.
+StateKey = Tuple[int, ...]
 
 
 class RLSolver(Solver):
-    def __init__(self, learning_rate=0.1, discount_factor=0.95, epsilon=0.3, episodes=1000, convergence_threshold=0.001):
+    def __init__(self, learning_rate=0.1, discount_factor=0.95, epsilon=0.3, episodes=1000, convergence_threshold=0.001,
+                 convergence_window=20, cache_dir=None, warm_episodes=100):
         self.learning_rate = learning_rate
         self.discount_factor = discount_factor
         self.epsilon = epsilon
         self.episodes = episodes
-        self.q_table: Dict[Tuple[State, Action], float] = {}
+        self.q_table: Dict[Tuple[StateKey, int], float] = {}
         self.convergence_threshold = convergence_threshold
+        # Training stops once the average score of the last window of episodes stops moving
+        self.convergence_window = convergence_window
+        # Score of every episode of the last solve
+        self.episode_scores: List[float] = []
+        # One key object per distinct state, shared by all the entries of the Q-table of that state
+        self.state_keys: Dict[StateKey, StateKey] = {}
+        # Available actions of every state seen, so a state's actions are only listed once
+        self.available_actions: Dict[StateKey, List[Action]] = {}
+        # Keys are action indices of one problem, so the Q-table is only kept while the problem is the same
+        self.q_problem = None
+        # Number of times every episode of the last solve listed the available actions of a state
+        self.catalog_scans: List[int] = []
+        # With a cache_dir, such as CACHE_DIR, the Q-table is saved there after every solve, and loaded by later
+        # solves of problems of the same type, recipes, parameters, pantry and plan length, which then only run
+        # warm_episodes episodes. None, the default, keeps it in memory only.
+        self.cache_dir = cache_dir
+        self.warm_episodes = warm_episodes
 
     def solve(self, problem: Problem, initial_state: State) -> State:
         """
         Solve the given problem using Q-learning and return the best solution found.
+        Training stops after the episode that runs past the deadline or into a cancellation.
         """
         best_state = None
         best_score = float('-inf')
 
-        for episode in range(self.episodes):
-            problem.reset_legal_actions()
+        path = None if self.cache_dir is None else learned_values_path(problem, type(self).__name__, self.cache_dir)
+        if problem is not self.q_problem:
+            self.q_table, self.state_keys, self.available_actions, self.q_problem = {}, {}, {}, problem
+            if path is not None:
+                self.q_table = load_q_table(path, problem) or {}
+                self.q_table = {(self.state_keys.setdefault(key, key), action): value
+                                for (key, action), value in self.q_table.items()}
+        episodes = min(self.episodes, self.warm_episodes) if self.q_table else self.episodes
+        self.catalog_scans = []
+        self.episode_scores = []
+        initial_key = self.state_key(initial_state)
+        for episode in range(episodes):
+            if best_state is not None and self.should_stop():
+                break
+            self.catalog_scans.append(0)
             self.epsilon *= 0.99
-            state = initial_state
+            state, key = initial_state, initial_key
             while not problem.is_goal_state(state):
-                available_actions = problem.get_available_actions(state)
+                available_actions = self.get_available_actions(problem, key, state)
                 if not available_actions:
                     break
-                action = self.choose_action(state, available_actions)
+                action = self.choose_action(key, available_actions)
                 next_state = state.__copy__()
                 next_state.update_state(action)
+                next_key = self.next_state_key(key, action)
 
-                reward = problem.get_action_score(action, state) + len(next_state.get_selected_actions)
-                self.update_q_value(state, action, reward, next_state, problem)
+                reward = problem.score_actions([action], state)[0] + len(next_state.get_selected_actions)
+                self.update_q_value(key, action, reward, next_key, next_state, problem)
 
-                state = next_state
+                state, key = next_state, next_key
             score = problem.get_score(state)
-            if abs(score - best_score) < self.convergence_threshold:
-                break
+            self.episode_scores.append(score)
             if score > best_score:
                 best_score = score
                 best_state = state
+                self.report_improvement(best_state, best_score)
+            if moving_average_converged(self.episode_scores, self.convergence_window, self.convergence_threshold):
+                break
 
+        if path is not None:
+            save_q_table(path, problem, self.q_table)
         return best_state
 
-    def choose_action(self, state: State, available_actions: List[Action]) -> Action:
+    def state_key(self, state: State) -> StateKey:
+        """Canonical key of the state in the Q-table"""
+        key = tuple(sorted(action.index for action in state.selected_actions))
+        return self.state_keys.setdefault(key, key)
+
+    def next_state_key(self, key: StateKey, action: Action) -> StateKey:
+        """Key of the state reached by making the action in the state with the given key"""
+        position = bisect.bisect_right(key, action.index)
+        next_key = key[:position] + (action.index,) + key[position:]
+        return self.state_keys.setdefault(next_key, next_key)
+
+    def get_available_actions(self, problem: Problem, key: StateKey, state: State) -> List[Action]:
+        """Available actions of the state with the given key, listed by the problem the first time it is seen"""
+        available_actions = self.available_actions.get(key)
+        if available_actions is None:
+            available_actions = self.available_actions[key] = problem.get_available_actions(state)
+            self.catalog_scans[-1] += 1
+        return available_actions
+
+    def choose_action(self, key: StateKey, available_actions: List[Action]) -> Action:
         if random.random() < self.epsilon:
             return random.choice(available_actions)
         else:
-            return max(available_actions, key=lambda a: self.get_q_value(state, a))
+            return max(available_actions, key=lambda a: self.get_q_value(key, a))
 
-    def update_q_value(self, state: State, action: Action, reward: float, next_state: State, problem: Problem):
-        current_q = self.get_q_value(state, action)
-        max_next_q = max(
-            self.get_q_value(next_state, a) for a in problem.get_available_actions(next_state)) if problem.get_available_actions(
-            next_state) else 0
+    def update_q_value(self, key: StateKey, action: Action, reward: float, next_key: StateKey, next_state: State,
+                       problem: Problem):
+        current_q = self.get_q_value(key, action)
+        next_actions = [] if problem.is_goal_state(next_state) else \
+            self.get_available_actions(problem, next_key, next_state)
+        max_next_q = max(self.get_q_value(next_key, a) for a in next_actions) if next_actions else 0
         new_q = current_q + self.learning_rate * (reward + self.discount_factor * max_next_q - current_q)
-        self.q_table[(state, action)] = new_q
+        self.q_table[(key, action.index)] = new_q
 
-    def get_q_value(self, state: State, action: Action) -> float:
-        return self.q_table.get((state, action), 0.0)
+    def get_q_value(self, key: StateKey, action: Action) -> float:
+        return self.q_table.get((key, action.index), 0.0)
@@ -1,63 +1,204 @@
+import itertools
 import random
 import math
-from typing import List, Tuple
+import time
+from typing import Callable, List, Optional, Tuple
 from ..Problems.problem import Problem
 from ..Problems.state import State
 from ..Problems.utils import Action
 from .solver import Solver
 
+# Moves of the neighbourhood, see apply_random_move
+MOVES = ("add", "remove", "replace", "swap", "move")
+
 
 class SimulatedAnnealingSolver(Solver):
-    def __init__(self, initial_temperature: float = 1000.0, cooling_rate: float = 0.995, iterations: int = 1000):
+    def __init__(self, initial_temperature: Optional[float] = None, cooling_rate: float = 0.995,
+                 iterations: Optional[int] = 1000, seed: Optional[int] = None, time_limit: Optional[float] = None,
+                 reheat_after: Optional[int] = 250, initial_acceptance: float = 0.8, calibration_moves: int = 100):
+        # Without an initial temperature, it is calibrated so that an average worsening move is accepted with
+        # probability initial_acceptance, see calibrate_temperature
         self.initial_temperature = initial_temperature
         self.cooling_rate = cooling_rate
+        # The chain stops after the iterations or the time limit in seconds, whichever comes first
         self.iterations = iterations
+        self.time_limit = time_limit
+        # The temperature goes back up to the initial one after this many iterations without a better plan, a quarter
+        # of the default iterations so a default chain can reheat. None never reheats.
+        self.reheat_after = reheat_after
+        self.initial_acceptance = initial_acceptance
+        self.calibration_moves = calibration_moves
+        # Chains with a seed draw from their own generator, the others from the global random module
+        self.random = random if seed is None else random.Random(seed)
 
     def solve(self, problem: Problem, initial_state: State) -> State:
-        current_state = initial_state
-        best_state = current_state
+        if self.iterations is None and self.time_limit is None and self.deadline is None and \
+                self.cancellation is None:
+            raise ValueError("Simulated annealing needs a number of iterations, a time limit, a deadline or a "
+                             "cancellation token.")
         temperature = self.initial_temperature
+        if temperature is None:
+            temperature = self.calibrate_temperature(problem, initial_state)
+        deadline = None if self.time_limit is None else time.time() + self.time_limit
+        return self.anneal(problem, initial_state, temperature, self.iterations, deadline)[2]
 
-        for _ in range(self.iterations):
-            if problem.is_goal_state(current_state):
-                break
+    def calibrate_temperature(self, problem: Problem, state: State) -> float:
+        """
+        Temperature at which the average worsening move of a random walk from the state is accepted with
+        probability initial_acceptance, so the chain starts on the scale of the scores of the problem.
+        """
+        state = state.__copy__()
+        score = problem.get_score(state)
+        worsening = []
+        for _ in range(self.calibration_moves):
+            if self.apply_random_move(problem, state) is None:
+                continue
+            new_score = problem.get_score(state)
+            if new_score < score:
+                worsening.append(score - new_score)
+            score = new_score
+        if not worsening:
+            return 1.0
+        return -sum(worsening) / len(worsening) / math.log(self.initial_acceptance)
 
-            neighbor_state = self.get_neighbor_state(problem, current_state)
-            current_score = problem.get_score(current_state)
-            neighbor_score = problem.get_score(neighbor_state)
+    def anneal(self, problem: Problem, current_state: State, temperature: float, iterations: Optional[int],
+               deadline: Optional[float] = None,
+               reheat_temperature: Optional[float] = None) -> Tuple[State, float, State, float, float]:
+        """
+        Run the chain from the given state and temperature for a number of iterations, or until the deadline, a
+        time.time() value, or the solver's deadline or cancellation. The chain keeps going once the plan is complete,
+        to find better complete plans, and reports every better plan to on_improvement.
+        Moves are made in place on a copy of the state and undone when they are rejected, so only improvements of
+        the best state are copied. After reheat_after iterations without a better plan, the temperature goes back
+        up to reheat_temperature, the given temperature by default.
+        Returns the current state and score, the best state and score, and the temperature it ended at, so the
+        chain can be continued later.
+        """
+        reheat_temperature = temperature if reheat_temperature is None else reheat_temperature
+        current_state = current_state.__copy__()
+        current_score = problem.get_score(current_state)
+        # Scores of the current and best states are kept instead of being evaluated again every iteration
+        best_state, best_score = current_state.__copy__(), current_score
+        stagnation = 0
 
-            if self.accept_probability(current_score, neighbor_score, temperature) > random.random():
-                current_state = neighbor_state
+        for _ in range(iterations) if iterations is not None else itertools.count():
+            if (deadline is not None and time.time() >= deadline) or self.should_stop():
+                break
 
-            if problem.get_score(current_state) > problem.get_score(best_state):
-                best_state = current_state
+            undo = self.apply_random_move(problem, current_state)
+            stagnation += 1
+            if undo is not None:
+                neighbor_score = problem.get_score(current_state)
+                if self.accept_probability(current_score, neighbor_score, temperature) > self.random.random():
+                    current_score = neighbor_score
+                    if current_score > best_score:
+                        best_state, best_score = current_state.__copy__(), current_score
+                        stagnation = 0
+                        self.report_improvement(best_state, best_score)
+                else:
+                    undo()
 
             temperature *= self.cooling_rate
+            if self.reheat_after is not None and stagnation >= self.reheat_after:
+                temperature, stagnation = reheat_temperature, 0
 
-        return best_state
+        return current_state, current_score, best_state, best_score, temperature
 
     def get_neighbor_state(self, problem: Problem, current_state: State) -> State:
-        new_state = State(current_state.get_available_pieces, current_state.get_selected_actions)
-
-        if len(new_state.selected_actions) > 0 and random.random() < 0.5:
-            # Remove a random action
-            removed_action = new_state.selected_actions.pop(random.randrange(len(new_state.selected_actions)))
-            for piece in removed_action.pieces:
-                for available_piece in new_state.get_available_pieces:
-                    if available_piece.item_id == piece.item_id:
-                        available_piece.quantity += piece.quantity
-                        break
-
-        # Add a new random action
-        available_actions = problem.get_available_actions(new_state)
-        if available_actions:
-            new_action = random.choice(available_actions)
-            new_state.update_state(new_action)
-
+        """A copy of the state with a random move made, see apply_random_move"""
+        new_state = current_state.__copy__()
+        self.apply_random_move(problem, new_state)
         return new_state
 
+    def apply_random_move(self, problem: Problem, state: State) -> Optional[Callable[[], None]]:
+        """
+        Make a random move on the state in place and return the function that undoes it, or None if the move
+        could not be made. The moves are:
+        add: a random available action on a random slot, unless the plan is complete, the later ones move a slot
+        later
+        remove: the action of a random slot, the later ones move a slot earlier
+        replace: the action of a random slot by a random action available on its day
+        swap: the actions of two slots, if each can be made on the day of the other
+        move: the action of a random slot to a random slot of another day, if all the moved actions can be made on
+        their new days
+        Random actions are drawn through the problem's expiration index, instead of listing the available ones.
+        """
+        plan = state.selected_actions
+        complete = problem.is_goal_state(state)
+        if complete and not plan:
+            return None
+        move = self.random.choice(MOVES[1:] if complete else MOVES if plan else MOVES[:1])
+        meals_per_day = problem.meals_per_day
+        expiration_days = problem.action_expiration_days
+
+        if move == "add":
+            position = self.random.randrange(len(plan) + 1)
+            action = problem.sample_available_action(state, position // meals_per_day, self.random)
+            if action is None or not self._can_shift_later(plan, position, expiration_days, meals_per_day):
+                return None
+            state.insert_action(position, action)
+            return lambda: state.remove_action(position)
+
+        first = self.random.randrange(len(plan))
+        if move == "remove":
+            action = state.remove_action(first)
+            return lambda: state.insert_action(first, action)
+
+        if move == "replace":
+            old_action = state.remove_action(first)
+            new_action = problem.sample_available_action(state, first // meals_per_day, self.random)
+            if new_action is None:
+                state.insert_action(first, old_action)
+                return None
+            state.insert_action(first, new_action)
+            return lambda: self._replace(state, first, old_action)
+
+        if move == "swap":
+            second = self.random.randrange(len(plan))
+            if expiration_days[plan[first].index] <= second // meals_per_day or \
+                    expiration_days[plan[second].index] <= first // meals_per_day:
+                return None
+            self._swap(plan, first, second)
+            return lambda: self._swap(plan, first, second)
+
+        # Move to a random slot of another day that is in the plan
+        days = (len(plan) - 1) // meals_per_day + 1
+        if days < 2:
+            return None
+        day = self.random.randrange(days - 1)
+        day += day >= first // meals_per_day
+        second = min(day * meals_per_day + self.random.randrange(meals_per_day), len(plan) - 1)
+        if not self._can_move(plan, first, second, expiration_days, meals_per_day):
+            return None
+        plan.insert(second, plan.pop(first))
+        return lambda: plan.insert(first, plan.pop(second))
+
+    @staticmethod
+    def _replace(state: State, position: int, action: Action) -> None:
+        state.remove_action(position)
+        state.insert_action(position, action)
+
+    @staticmethod
+    def _swap(plan: List[Action], first: int, second: int) -> None:
+        plan[first], plan[second] = plan[second], plan[first]
+
+    @staticmethod
+    def _can_shift_later(plan: List[Action], start: int, expiration_days, meals_per_day: int, end=None) -> bool:
+        """Can the actions from the start slot up to the end slot, the end of the plan by default, move a slot later"""
+        return all(expiration_days[plan[position].index] > (position + 1) // meals_per_day
+                   for position in range(start, len(plan) if end is None else end))
+
+    def _can_move(self, plan: List[Action], source: int, target: int, expiration_days, meals_per_day: int) -> bool:
+        """Can the action of the source slot move to the target slot. Actions in between move a slot towards the
+        source, which only matters when they move to a later day."""
+        if expiration_days[plan[source].index] <= target // meals_per_day:
+            return False
+        return self._can_shift_later(plan, target, expiration_days, meals_per_day, source)
+
     @staticmethod
     def accept_probability(current_score: float, new_score: float, temperature: float) -> float:
         if new_score > current_score:
             return 1.0
+        if temperature <= 0:
+            return 0.0
         return math.exp((new_score - current_score) / temperature)
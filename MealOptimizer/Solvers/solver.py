@@ -1,10 +1,112 @@
+import threading
+import time
 from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+import numpy as np
+
 from ..Problems.problem import Problem
 from ..Problems.state import State
 
+# What a worker process received when it started, see start_worker
+_worker_context: tuple = ()
+
+
+class CancellationToken:
+    """Lets another thread, like a GUI button, ask a running solver to stop and return its best plan so far"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
 
 class Solver(ABC):
+    # Anytime controls, see configure. Class attributes so that every solver has them without calling this __init__.
+    deadline: Optional[float] = None
+    on_improvement: Optional[Callable[[State, float], None]] = None
+    cancellation: Optional[CancellationToken] = None
+
     @abstractmethod
     def solve(self, problem: Problem, state: State) -> State:
         """Solve the given problem and return the solution."""
         raise NotImplementedError
+
+    def configure(self, deadline: Optional[float] = None,
+                  on_improvement: Optional[Callable[[State, float], None]] = None,
+                  cancellation: Optional[CancellationToken] = None) -> "Solver":
+        """
+        Set the anytime controls every solver honours: solve returns its best plan so far once the deadline, a
+        time.time() value, has passed or the cancellation token is cancelled, and calls on_improvement with every
+        better plan it finds and its score. Returns the solver.
+        """
+        self.deadline = deadline
+        self.on_improvement = on_improvement
+        self.cancellation = cancellation
+        return self
+
+    def should_stop(self) -> bool:
+        """Has the deadline passed or the solve been cancelled"""
+        return (self.cancellation is not None and self.cancellation.cancelled) or \
+            (self.deadline is not None and time.time() >= self.deadline)
+
+    def report_improvement(self, state: State, score: float) -> None:
+        if self.on_improvement is not None:
+            self.on_improvement(state, score)
+
+    def report_progress(self, problem: Problem, state: State, best_score: float) -> float:
+        """Report a copy of a state that is still being built to on_improvement if it scores better than best_score.
+        Returns the best score. Does not score the state when there is no on_improvement."""
+        if self.on_improvement is None:
+            return best_score
+        score = problem.get_score(state)
+        if score > best_score:
+            self.on_improvement(state.__copy__(), score)
+            return score
+        return best_score
+
+    def earliest_deadline(self, deadline: Optional[float]) -> Optional[float]:
+        """The earlier of the given deadline and the solver's deadline"""
+        if deadline is None or self.deadline is None:
+            return self.deadline if deadline is None else deadline
+        return min(deadline, self.deadline)
+
+
+def best_sums(values: np.ndarray, repeat_limits: np.ndarray, most: int) -> np.ndarray:
+    """Highest sum of 1, 2, ... up to `most` values, each one taken at most as often as its repeat limit"""
+    order = np.argsort(-values, kind="stable")
+    needed = np.searchsorted(np.cumsum(repeat_limits[order]), most) + 1
+    order = order[:needed]
+    return np.cumsum(np.repeat(values[order], repeat_limits[order])[:most])
+
+
+def moving_average_converged(scores: list, window: int, threshold: float) -> bool:
+    """Has the average score of the last `window` episodes moved less than the threshold from the `window` before"""
+    if window <= 0 or len(scores) < 2 * window:
+        return False
+    return abs(np.mean(scores[-window:]) - np.mean(scores[-2 * window:-window])) < threshold
+
+
+def replay_plan(problem: Problem, initial_state: State, plan: List[int]) -> State:
+    """A copy of the initial state with the actions of a plan, given by their indices, made in order"""
+    state = initial_state.__copy__()
+    for index in plan:
+        state.update_state(problem.legal_actions[index])
+    return state
+
+
+def start_worker(*context) -> None:
+    """Initializer of worker processes: keeps what every task of the worker needs, like the problem and the initial
+    state, so it is sent once when the worker starts instead of with every task"""
+    global _worker_context
+    _worker_context = context
+
+
+def worker_context() -> tuple:
+    """What start_worker kept in this worker process"""
+    return _worker_context
@@ -6,7 +6,7 @@ import pandas as pd
 import numpy as np
 from typing import List, Dict, Any
 from MealOptimizer.Solvers import RLSolver
-from MealOptimizer.Problems import MinimizeWasteProblem, CountExpiredItemsProblem
+from MealOptimizer.Problems import MinimizeWasteProblem, CountExpiredItemsProblem, load_catalog
 from MealOptimizer.Experiments import Experiment
 import os
 from tqdm import tqdm
@@ -177,7 +177,7 @@ class RLSolverVisualization:
 def main():
     # Setup your experiment parameters
     piece_dataset = pd.read_csv("../Datasets/non optimality of greedy/products.csv")
-    action_dataset = pd.read_csv("../Datasets/non optimality of greedy/recipes.csv")
+    action_dataset = load_catalog("../Datasets/non optimality of greedy/recipes.csv")
     start_date = date(2024, 9, 1)
     initial_state = Experiment.create_initial_state(piece_dataset)
 
@@ -9,7 +9,8 @@ from typing import List, Dict, Tuple
 from datetime import date, timedelta
 
 from MealOptimizer.Experiments import Experiment
-from MealOptimizer.Problems import MinimizeWasteProblem, CountExpiredItemsProblem, ParametersProblem
+from MealOptimizer.Problems import MinimizeWasteProblem, CountExpiredItemsProblem, ParametersProblem, load_catalog
+from MealOptimizer.Problems.catalog import CACHE_DIR
 from MealOptimizer.Solvers import GreedySolver, SimulatedAnnealingSolver,  RLSolver
 
 
@@ -134,11 +135,11 @@ class MealOptimizationVisualizer:
 
 def run_experiments(problem_classes, products_data_path: str, recipes_data_path: str,
                     parameter_sets: List[Dict], num_runs: int = 10):
-    solvers = [GreedySolver(), SimulatedAnnealingSolver(),  RLSolver()]
+    solvers = [GreedySolver(), SimulatedAnnealingSolver(),  RLSolver(cache_dir=CACHE_DIR)]
     results = {problem.__name__: {} for problem in problem_classes}
 
     products_df = pd.read_csv(products_data_path)
-    recipes_df = pd.read_csv(recipes_data_path)
+    recipes_df = load_catalog(recipes_data_path)
 
     for problem_class in problem_classes:
         for i, params in enumerate(parameter_sets):
@@ -207,10 +208,10 @@ def visualize_results(results: Dict[str, Dict[str, Dict[str, List[Tuple[float, f
 def run_experiments_with_different_datasets(problem_classes, products_data_paths: Dict[str, str],
                                             recipes_data_path: str,
                                             parameter_sets: List[Dict], num_runs: int = 10):
-    solvers = [GreedySolver(), SimulatedAnnealingSolver(), RLSolver()]
+    solvers = [GreedySolver(), SimulatedAnnealingSolver(), RLSolver(cache_dir=CACHE_DIR)]
     results = {problem.__name__: {} for problem in problem_classes}
 
-    recipes_df = pd.read_csv(recipes_data_path)
+    recipes_df = load_catalog(recipes_data_path)
 
     for dataset_name, products_data_path in products_data_paths.items():
         products_df = pd.read_csv(products_data_path)
@@ -2,6 +2,8 @@ import random
 
 from MealOptimizer.Experiments import Experiment
 from MealOptimizer import Problems
+from MealOptimizer.Problems import load_catalog
+from MealOptimizer.Problems.catalog import CACHE_DIR
 from MealOptimizer.Solvers import GreedySolver, SimulatedAnnealingSolver, RLSolver
 from datetime import date
 from MealOptimizer.GUI.main_gui import MealPlannerGUI
@@ -10,12 +12,14 @@ import pandas as pd
 
 def main_cmd():
     problem = Problems.MinimizeWasteProblem
-    solvers = [GreedySolver(), SimulatedAnnealingSolver(), RLSolver()]
+    solvers = [GreedySolver(), SimulatedAnnealingSolver(), RLSolver(cache_dir=CACHE_DIR)]
     # solvers = [RLSolver()]
     products_data_path = "MealOptimizer/Datasets/non optimality of greedy/products.csv"  # insert path
     recipes_data_path = "MealOptimizer/Datasets/non optimality of greedy/recipes.csv"  # insert path
     start_date = date(2024, 9, 1)
-    experiment = Experiment(problem, solvers, start_date, pd.read_csv(products_data_path), pd.read_csv(recipes_data_path),
+    products = pd.read_csv(products_data_path)
+    recipes = load_catalog(recipes_data_path, available_products=products["Product Name"])
+    experiment = Experiment(problem, solvers, start_date, products, recipes,
                             number_of_days=12,
                             meals_per_day=1)
     results = experiment.run()
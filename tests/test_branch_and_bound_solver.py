@@ -0,0 +1,36 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from MealOptimizer.Problems import CountExpiredItemsProblem, MinimizeWasteProblem, ParametersProblem
+from MealOptimizer.Problems.state import State
+from MealOptimizer.Solvers import BranchAndBoundSolver, GreedySolver
+
+DATASETS = os.path.join(os.path.dirname(__file__), os.pardir, "MealOptimizer", "Datasets")
+
+# Products, recipes, start date, number of days and meals per day of the small bundled datasets, from their config
+CASES = [("non optimality of greedy/products.csv", "non optimality of greedy/recipes.csv", date(2024, 9, 1), 12, 1),
+         ("simulated_annealing_algorithm_only/small_products_for_greedy.csv",
+          "simulated_annealing_algorithm_only/greedy_reciepes.csv", date(2024, 9, 21), 2, 1)]
+
+
+@pytest.mark.parametrize("problem_class", [MinimizeWasteProblem, CountExpiredItemsProblem, ParametersProblem])
+@pytest.mark.parametrize("products_path, recipes, start_date, number_of_days, meals_per_day", CASES)
+def test_proves_small_datasets_optimal(problem_class, products_path, recipes, start_date, number_of_days,
+                                       meals_per_day):
+    products = pd.read_csv(os.path.join(DATASETS, products_path))
+    parameters = {"parameters_to_maximize": ["Taste Rating", "Number of Steps"]} \
+        if problem_class is ParametersProblem else {}
+    problem = problem_class(pd.read_csv(os.path.join(DATASETS, recipes)), start_date,
+                            products[["Product Name", "Date"]], number_of_days=number_of_days,
+                            meals_per_day=meals_per_day, **parameters)
+    solver = BranchAndBoundSolver(time_limit=None)
+    plan = solver.solve(problem, State.from_dataframe(products))
+
+    assert solver.proven_optimal
+    assert solver.gap == pytest.approx(0)
+    assert problem.get_score(plan) == pytest.approx(solver.best_score)
+    greedy = GreedySolver().solve(problem, State.from_dataframe(products))
+    assert solver.best_score >= problem.get_score(greedy) - 1e-9
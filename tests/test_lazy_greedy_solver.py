@@ -0,0 +1,39 @@
+import glob
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from MealOptimizer.Problems import CountExpiredItemsProblem, MinimizeWasteProblem, ParametersProblem
+from MealOptimizer.Problems.state import State
+from MealOptimizer.Solvers import GreedySolver, LazyGreedySolver
+
+DATASETS = os.path.join(os.path.dirname(__file__), os.pardir, "MealOptimizer", "Datasets")
+
+# Products, recipes, start date, number of days and meals per day of every bundled dataset
+CASES = [("non optimality of greedy/products.csv", "non optimality of greedy/recipes.csv", date(2024, 9, 1), 12, 1),
+         ("simulated_annealing_algorithm_only/small_products_for_greedy.csv",
+          "simulated_annealing_algorithm_only/greedy_reciepes.csv", date(2024, 9, 21), 2, 1)] + \
+        [(os.path.relpath(path, DATASETS), "recipes_smaller.csv", date(2024, 9, 1), 7, 3)
+         for path in sorted(glob.glob(os.path.join(DATASETS, "products_dataset", "known_*.csv")))]
+
+
+def make_problem(problem_class, products, recipes, start_date, number_of_days, meals_per_day):
+    parameters = {"parameters_to_maximize": ["Taste Rating", "Number of Steps"]} \
+        if problem_class is ParametersProblem else {}
+    return problem_class(pd.read_csv(os.path.join(DATASETS, recipes)), start_date,
+                         products[["Product Name", "Date"]], number_of_days=number_of_days,
+                         meals_per_day=meals_per_day, **parameters)
+
+
+@pytest.mark.parametrize("problem_class", [MinimizeWasteProblem, CountExpiredItemsProblem, ParametersProblem])
+@pytest.mark.parametrize("products_path, recipes, start_date, number_of_days, meals_per_day", CASES)
+def test_same_plans_as_greedy(problem_class, products_path, recipes, start_date, number_of_days, meals_per_day):
+    products = pd.read_csv(os.path.join(DATASETS, products_path))
+    problem = make_problem(problem_class, products, recipes, start_date, number_of_days, meals_per_day)
+    greedy = GreedySolver().solve(problem, State.from_dataframe(products))
+    lazy = LazyGreedySolver().solve(problem, State.from_dataframe(products))
+
+    assert [action.index for action in lazy.selected_actions] == \
+        [action.index for action in greedy.selected_actions]
@@ -0,0 +1,27 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from MealOptimizer.Problems import CountExpiredItemsProblem, MinimizeWasteProblem
+from MealOptimizer.Problems.state import State
+from MealOptimizer.Solvers import LinearRLSolver, SimulatedAnnealingSolver
+
+DATASETS = os.path.join(os.path.dirname(__file__), os.pardir, "MealOptimizer", "Datasets")
+
+
+@pytest.fixture(scope="module")
+def products():
+    return pd.read_csv(os.path.join(DATASETS, "products_dataset", "known_200.csv"))
+
+
+@pytest.mark.parametrize("problem_class", [MinimizeWasteProblem, CountExpiredItemsProblem])
+def test_matches_simulated_annealing_on_known_200(products, problem_class):
+    recipes = pd.read_csv(os.path.join(DATASETS, "recipes_smaller.csv"))
+    problem = problem_class(recipes, date(2024, 9, 1), products[["Product Name", "Date"]], number_of_days=5,
+                            meals_per_day=3)
+    plan = LinearRLSolver(seed=0).solve(problem, State.from_dataframe(products))
+    annealed = SimulatedAnnealingSolver(seed=0).solve(problem, State.from_dataframe(products))
+
+    assert problem.get_score(plan) >= problem.get_score(annealed) - 1e-9
@@ -0,0 +1,63 @@
+import ast
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from MealOptimizer.Problems import MinimizeWasteProblem
+from MealOptimizer.Problems.state import State
+from MealOptimizer.Solvers import LazyGreedySolver, MCTSSolver
+
+DATASETS = os.path.join(os.path.dirname(__file__), os.pardir, "MealOptimizer", "Datasets")
+START_DATE = date(2024, 9, 1)
+
+
+@pytest.fixture(scope="module")
+def products():
+    """Every product of the bundled recipes, with enough stock to plan a whole year"""
+    recipes = pd.read_csv(os.path.join(DATASETS, "recipes_smaller.csv"))
+    names = sorted({name.strip() for products in recipes["Products"].map(ast.literal_eval) for name in products})
+    generator = np.random.default_rng(0)
+    return pd.DataFrame({
+        "Product Name": names,
+        "Date": [str(START_DATE + timedelta(days=int(days))) for days in generator.integers(1, 400, len(names))],
+        "Quantity": generator.integers(5, 40, len(names)),
+    })
+
+
+@pytest.fixture(scope="module")
+def problem(products):
+    recipes = pd.read_csv(os.path.join(DATASETS, "recipes_smaller.csv"))
+    return MinimizeWasteProblem(recipes, START_DATE, products, number_of_days=365, meals_per_day=3)
+
+
+class RecordingMCTSSolver(MCTSSolver):
+    """Records the deadline of the solve and when every rollout started"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.solve_deadline = None
+        self.rollout_starts = []
+
+    def earliest_deadline(self, deadline):
+        self.solve_deadline = super().earliest_deadline(deadline)
+        return self.solve_deadline
+
+    def roll_out(self, *args, **kwargs):
+        self.rollout_starts.append(time.time())
+        return super().roll_out(*args, **kwargs)
+
+
+@pytest.mark.parametrize("rollout_policy", ["random", "greedy"])
+def test_time_limit_bounds_the_solve(problem, products, rollout_policy):
+    solver = RecordingMCTSSolver(rollouts=None, time_limit=1.0, rollout_policy=rollout_policy, seed=0)
+    plan = solver.solve(problem, State.from_dataframe(products))
+
+    # A year of meal slots does not fit in the time limit, and once it passes the plan is completed without rollouts
+    assert solver.rollout_starts
+    assert not [start for start in solver.rollout_starts if start >= solver.solve_deadline]
+    greedy = LazyGreedySolver().solve(problem, State.from_dataframe(products))
+    assert problem.get_score(plan) >= problem.get_score(greedy) - 1e-9
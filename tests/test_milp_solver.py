@@ -0,0 +1,49 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from MealOptimizer.Problems import MinimizeWasteProblem
+from MealOptimizer.Problems.state import State
+from MealOptimizer.Solvers import GreedySolver, MILPSolver
+
+
+@pytest.fixture
+def products():
+    return pd.DataFrame({"Product Name": ["salt", "rice", "beans"],
+                         "Date": ["2024-09-03", "2024-09-10", "2024-09-10"],
+                         "Quantity": [1, 1, 1]})
+
+
+@pytest.fixture
+def problem(products):
+    # The salty recipe lists salt twice, and there is only one salt
+    recipes = pd.DataFrame({"Recipe ID": [1, 2, 3], "Recipe Name": ["salty", "rice", "beans"],
+                            "Products": [str(["salt", "salt"]), str(["rice"]), str(["beans"])]})
+    return MinimizeWasteProblem(recipes, date(2024, 9, 1), products, number_of_days=3, meals_per_day=1)
+
+
+def test_product_listed_twice_is_used_once(problem, products):
+    salty = problem.legal_actions[0]
+    assert [piece.item_id for piece in salty.pieces] == ["salt"]
+    assert problem.incidence[0].toarray().tolist() == [[1, 0, 0]]
+
+    state = State.from_dataframe(products)
+    state.update_state(salty)
+    assert state.quantity("salt") == 0
+    assert problem.repeat_limits(State.from_dataframe(products), [0]).tolist() == [1]
+
+
+def test_milp_matches_greedy_with_duplicate_products(problem, products):
+    greedy = GreedySolver().solve(problem, State.from_dataframe(products))
+    solver = MILPSolver(time_limit=30)
+    plan = solver.solve(problem, State.from_dataframe(products))
+
+    assert len(plan.selected_actions) == 3
+    assert problem.get_score(plan) == pytest.approx(problem.get_score(greedy))
+    assert solver.proven_optimal
+    # Every recipe of the plan can be made when its turn comes
+    state = State.from_dataframe(products)
+    for action in plan.selected_actions:
+        assert problem.is_available_action(action, state)
+        state.update_state(action)